@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# Copyright (C) 2015  Johannes Dewender
+# This benchmark is free. You can redistribute and/or modify it at will.
+"""Benchmarks for isrcsubmit
+
+Every benchmark is run several times and the minimum and median
+are printed.  The full runs use the mocked web service and disc data
+from test_isrcsubmit.py or the stand-in server from mbstandin.py.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+from optparse import OptionParser
+from subprocess import Popen, PIPE
+
+SCRIPT_NAME = "isrcsubmit.py"
+RUNS = 10
+# number of tracks in the synthetic backend output
+TRACKS = 10000
+# the load test runs concurrent sessions against a slow server,
+# which is sometimes overloaded
+LOAD_CONCURRENCY = 8
+LOAD_LATENCY = 0.05
+LOAD_ERROR_RATE = 0.02
+LOAD_RATE_LIMIT = 50
+
+# the mocks are installed when test_isrcsubmit is imported
+FULL_RUN = """
+import test_isrcsubmit
+import isrcsubmit
+test_isrcsubmit.mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+isrcsubmit.main(["isrcsubmit.py", "--backend", "libdiscid", "--no-keyring"])
+"""
+# the disc is mocked, the web service is the stand-in server
+STANDIN_RUN = """
+import test_isrcsubmit
+import isrcsubmit
+import musicbrainzngs
+musicbrainzngs.get_releases_by_discid = \\
+        test_isrcsubmit._mbngs_get_releases_by_discid
+musicbrainzngs.get_release_by_id = test_isrcsubmit._mbngs_get_release_by_id
+musicbrainzngs.submit_isrcs = test_isrcsubmit._mbngs_submit_isrcs
+isrcsubmit.getpass.getpass = lambda prompt: "password"
+test_isrcsubmit.mocked_disc_id = "%(disc_id)s"
+isrcsubmit.main(["isrcsubmit.py", "--backend", "libdiscid", "--no-keyring",
+                 "--user", "bench", "--server", "%(server)s"])
+"""
+
+
+def report(name, timings, unit="ms"):
+    timings = sorted(timings)
+    median = timings[len(timings) // 2]
+    print("%-24s min %8.2f %s   median %8.2f %s   (%d runs)"
+          % (name, timings[0], unit, median, unit, len(timings)))
+
+def run_script(args, stdin=b"", env=None):
+    """Runs a python process and returns the wall time in ms
+    """
+    start = time.time()
+    proc = Popen([sys.executable] + args, stdin=PIPE, stdout=PIPE,
+                 stderr=PIPE, env=env)
+    proc.communicate(stdin)
+    duration = (time.time() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError("%s returned with %i"
+                           % (" ".join(args), proc.returncode))
+    return duration
+
+
+def bench_startup(runs):
+    """Startup time of the most simple invocations
+    """
+    report("import", [run_script(["-c", "import isrcsubmit"])
+                      for i in range(runs)])
+    report("--version", [run_script([SCRIPT_NAME, "--version"])
+                         for i in range(runs)])
+    report("-h", [run_script([SCRIPT_NAME, "-h"]) for i in range(runs)])
+
+def fresh_run(args, stdin):
+    """Runs without configuration and cache, returns the wall time in ms
+    """
+    config_home = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env["XDG_CONFIG_HOME"] = config_home
+    try:
+        return run_script(args, stdin, env)
+    finally:
+        shutil.rmtree(config_home)
+
+def bench_full_run(runs):
+    """A full run with mocked disc and web service
+    """
+    report("full run (mocked)", [fresh_run(["-c", FULL_RUN], b"\n" * 10)
+                                 for i in range(runs)])
+
+def bench_wire(runs):
+    """A full run against the stand-in server, counting the traffic
+    """
+    import mbstandin
+    server = mbstandin.StandIn()
+    server.start()
+    timings = []
+    try:
+        for i in range(runs):
+            server.reset()
+            # the disc is ambiguous, the first release is chosen
+            run = STANDIN_RUN % {"disc_id": "hSI7B4G4AkB5.DEBcW.3KCn.D_E-",
+                                 "server": server.host}
+            timings.append(fresh_run(["-c", run], b"1\n" + b"\n" * 10))
+    finally:
+        server.shutdown()
+        server.server_close()
+    report("full run (stand-in)", timings)
+    stats = server.stats
+    print("%-24s %d connections, %d requests, %d bytes"
+          " (%d bytes uncompressed)"
+          % ("wire per run", stats["connections"], stats["requests"],
+             stats["bytes_sent"], stats["bytes_uncompressed"]))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def bench_load(runs):
+    """Concurrent sessions submitting ISRCs to the stand-in server
+
+    Every worker runs a session per run.
+    """
+    import mbstandin
+    # the ISRCs are never added, so every session submits them
+    server = mbstandin.StandIn(latency=LOAD_LATENCY,
+                               error_rate=LOAD_ERROR_RATE,
+                               rate_limit=LOAD_RATE_LIMIT,
+                               without_isrcs=True, apply_submissions=False)
+    server.start()
+    run = STANDIN_RUN % {"disc_id": "TqvKjMu7dMliSfmVEBtrL7sBSno-",
+                         "server": server.host}
+    latencies = []
+    failures = []
+
+    def worker():
+        for i in range(runs):
+            # don't open the browser, but submit
+            try:
+                latencies.append(fresh_run(["-c", run],
+                                           b"\ny\n" + b"\n" * 10))
+            except RuntimeError as err:
+                failures.append(err)
+
+    workers = [threading.Thread(target=worker)
+               for i in range(LOAD_CONCURRENCY)]
+    start = time.time()
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        duration = time.time() - start
+        server.shutdown()
+        server.server_close()
+    stats = server.stats
+    print("%-24s %d sessions, %d concurrent, %d failed"
+          % ("load", len(latencies) + len(failures), LOAD_CONCURRENCY,
+             len(failures)))
+    if latencies:
+        print("%-24s p50 %8.2f ms   p95 %8.2f ms   p99 %8.2f ms"
+              % ("session latency", percentile(latencies, 0.5),
+                 percentile(latencies, 0.95), percentile(latencies, 0.99)))
+    print("%-24s %.2f sessions/s   %.2f requests/s"
+          % ("throughput", len(latencies) / duration,
+             stats["requests"] / duration))
+    print("%-24s %d requests, %d errors injected, %d rate limited,"
+          " %d ISRCs submitted"
+          % ("server", stats["requests"], stats["errors"],
+             stats["rate_limited"], stats["submitted_isrcs"]))
+
+
+class SyntheticTrack(object):
+    def __init__(self, number, isrc):
+        self.number = number
+        self.isrc = isrc
+
+def synthetic_output(backend, tracks):
+    """Creates output of the backend for the given number of tracks
+    """
+    isrcs = [(number, "DEA12%02d%05d" % (number % 100, number))
+             for number in range(1, tracks + 1)]
+    if backend == "libdiscid":
+        return [SyntheticTrack(number, isrc) for number, isrc in isrcs]
+    elif backend == "discisrc":
+        return ["Track %2d : %s\n" % item for item in isrcs]
+    elif backend in ["mediatools", "media_info"]:
+        return ["ISRC %02d %s\n" % item for item in isrcs]
+    elif backend == "cdrdao":
+        # the relevant lines of a toc file
+        output = []
+        for number, isrc in isrcs:
+            output.extend(["\n", "// Track %d\n" % number, "TRACK AUDIO\n",
+                           'ISRC "%s"\n' % isrc])
+        return output
+    else:
+        return []
+
+def bench_parsers(runs):
+    """Parsing the output of every backend, without running it
+    """
+    import isrcsubmit
+    for name in isrcsubmit.BACKENDS:
+        backend = isrcsubmit.get_backend(name)
+        output = synthetic_output(name, TRACKS)
+        if not output:
+            continue
+        timings = []
+        for i in range(runs):
+            start = time.time()
+            parsed = list(backend.parse(output))
+            timings.append((time.time() - start) * 1000000 / len(output))
+            assert len(parsed) == TRACKS
+        report("parse %s" % name, timings, unit="us/item")
+
+def peak_memory(function, *args):
+    """Returns the peak memory in kB allocated while the function runs,
+    None when it can't be measured.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+def bench_formats(runs):
+    """Parsing the release lists in test_data/ as XML and as JSON
+    """
+    import json
+    import mbstandin
+    import isrcsubmit
+    from musicbrainzngs import mbxml
+    parsers = [("xml", mbstandin.to_xml,
+                lambda document: mbxml.parse_message(BytesIO(document))),
+               ("json", mbstandin.to_json,
+                lambda document: isrcsubmit.from_json(
+                        json.loads(document.decode("utf-8"))))]
+    fixtures = mbstandin.Fixtures()
+    for disc_id in sorted(fixtures.discs):
+        for name, convert, parse in parsers:
+            document = convert(fixtures.discs[disc_id])
+            timings = []
+            for i in range(runs):
+                start = time.time()
+                parse(document)
+                timings.append((time.time() - start) * 1000)
+            report("parse %s %s" % (name, disc_id[:8]), timings)
+            memory = peak_memory(parse, document)
+            if memory is not None:
+                print("%-24s peak %8.0f kB   document %8.0f kB"
+                      % ("", memory, len(document) / 1024.0))
+
+def retained_memory(function, *args):
+    """Returns the memory in kB still allocated by the result of the
+    function, None when it can't be measured.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    try:
+        # the result is only freed after the measurement
+        result = function(*args)
+        return tracemalloc.get_traced_memory()[0] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+def bench_model(runs):
+    """Projecting the releases in test_data/ to the compact model
+
+    The memory is what is kept for a batch of releases.
+    """
+    import json
+    import isrcsubmit
+    releases = []
+    for name in sorted(os.listdir("test_data")):
+        if name.endswith("_releases.json"):
+            with open(os.path.join("test_data", name)) as data:
+                releases.extend(json.load(data)["disc"]["release-list"])
+    timings = []
+    for i in range(runs):
+        start = time.time()
+        for release in releases:
+            isrcsubmit.CompactRelease(release)
+        timings.append((time.time() - start) * 1000 / len(releases))
+    report("project release", timings, unit="ms/item")
+
+    # decoding again gives every release its own objects
+    documents = [json.dumps(release) for release in releases] * 100
+    full = retained_memory(lambda: [json.loads(document)
+                                    for document in documents])
+    compact = retained_memory(lambda: [
+            isrcsubmit.CompactRelease(json.loads(document))
+            for document in documents])
+    if full is not None:
+        print("%-24s full %8.0f kB   compact %8.0f kB   (%d releases)"
+              % ("kept releases", full, compact, len(documents)))
+
+
+BENCHMARKS = [
+    ("startup", bench_startup),
+    ("full_run", bench_full_run),
+    ("wire", bench_wire),
+    ("load", bench_load),
+    ("parsers", bench_parsers),
+    ("formats", bench_formats),
+    ("model", bench_model),
+]
+
+def main(argv):
+    names = [name for name, function in BENCHMARKS]
+    parser = OptionParser(usage="%%prog [options] [%s ...]"
+                          % "|".join(names))
+    parser.add_option("-n", "--runs", type="int", default=RUNS,
+            help="How often every benchmark is run. Default: %d" % RUNS)
+    (options, args) = parser.parse_args(argv[1:])
+    for name in args:
+        if name not in names:
+            parser.error("unknown benchmark: %s" % name)
+
+    # the benchmarks use relative paths
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for name, function in BENCHMARKS:
+        if not args or name in args:
+            function(options.runs)
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -23,7 +23,35 @@ https://github.com/JonnyJD/musicbrainz-isrcsubmit
 
 __version__ = "2.0.1"
 AGENT_NAME = "isrcsubmit.py"
+AGENT_URL = "http://github.com/JonnyJD/musicbrainz-isrcsubmit"
 DEFAULT_SERVER = "musicbrainz.org"
+# web service lookups are cached for a day, unknown disc IDs for 10 minutes
+CACHE_TTL = 24 * 60 * 60
+CACHE_NEGATIVE_TTL = 10 * 60
+CACHE_SIZE = 1000
+# requests per second allowed by the MusicBrainz server
+RATE_LIMIT = 1.0
+# requests waiting for the rate limit, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+# track lengths differing less than this (in ms) match the TOC
+LENGTH_TOLERANCE = 2000
+# ISRC lookups running at the same time with --check-isrcs
+ISRC_WORKERS = 4
+# recordings per submission request
+SUBMIT_CHUNK_SIZE = 100
+# a chunk is retried this often, after a jittered delay doubling every time
+SUBMIT_RETRIES = 5
+SUBMIT_BACKOFF = 2.0
+# temporary server errors, retried like failed chunks
+SERVER_ERRORS = [500, 502, 503]
+SERVER_RETRIES = 5
+SERVER_BACKOFF = 2.0
+# --verify polls this often, after a delay doubling every time
+VERIFY_ATTEMPTS = 4
+VERIFY_DELAY = 2.0
+# recordings per browse request
+BROWSE_LIMIT = 100
 # starting with highest priority
 BACKENDS = ["mediatools", "media_info", "cdrdao", "libdiscid", "discisrc"]
 BROWSERS = ["xdg-open", "x-www-browser",
@@ -34,47 +62,34 @@ BROWSERS = ["xdg-open", "x-www-browser",
 import os
 import re
 import sys
+import json
+import time
+import zlib
 import codecs
 import logging
+import heapq
+import random
+import shutil
 import getpass
-import tempfile
-import webbrowser
-from datetime import datetime
+import threading
+from io import BytesIO
 from optparse import OptionParser
-from subprocess import Popen, PIPE, call
+from subprocess import Popen, PIPE
 
 try:
-    import discid
-    from discid import DiscError
-except ImportError:
-    try:
-        from libdiscid.compat import discid
-        from libdiscid.compat.discid import DiscError
-    except ImportError:
-        # When both are not available, raise exception for python-discid
-        import discid
-
-import musicbrainzngs
-from musicbrainzngs import AuthenticationError, ResponseError, WebServiceError
-
-try:
-    import keyring
+    from configparser import ConfigParser
 except ImportError:
-    keyring = None
+    from ConfigParser import ConfigParser
 
 try:
-    from configparser import ConfigParser
+    from queue import Queue
 except ImportError:
-    from ConfigParser import ConfigParser
+    from Queue import Queue
 
 if os.name == "nt":
     SHELLNAME = "isrcsubmit.bat"
 else:
     SHELLNAME = "isrcsubmit.sh"
-if os.path.isfile(SHELLNAME):
-    SCRIPTNAME = SHELLNAME
-else:
-    SCRIPTNAME = os.path.basename(sys.argv[0])
 
 # make code run on Python 2 and 3
 try:
@@ -87,14 +102,92 @@ try:
 except NameError:
     unicode_string = str
 
+
+class LazyModule(object):
+    """A module that is only imported when it is used for the first time.
+
+    This keeps the startup fast, especially for --version and -h.
+    """
+
+    def __init__(self, importer):
+        object.__setattr__(self, "_importer", importer)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        module = object.__getattribute__(self, "_module")
+        if module is None:
+            module = object.__getattribute__(self, "_importer")()
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+def import_discid():
+    try:
+        import discid
+    except ImportError:
+        try:
+            from libdiscid.compat import discid
+        except ImportError:
+            # When both are not available, raise exception for python-discid
+            import discid
+    return discid
+
+def import_http_client():
+    try:
+        import http.client as http_client
+    except ImportError:
+        import httplib as http_client
+    return http_client
+
+def import_urllib_request():
+    try:
+        import urllib.request as urllib_request
+    except ImportError:
+        import urllib2 as urllib_request
+    return urllib_request
+
+def import_keyring():
+    """Returns the keyring module, None if it is not available
+    """
+    try:
+        import keyring
+    except ImportError:
+        return None
+    else:
+        return keyring
+
+discid = LazyModule(import_discid)
+musicbrainzngs = LazyModule(lambda: __import__("musicbrainzngs"))
+http_client = LazyModule(import_http_client)
+urllib_request = LazyModule(import_urllib_request)
+sqlite3 = LazyModule(lambda: __import__("sqlite3"))
+tarfile = LazyModule(lambda: __import__("tarfile"))
+tempfile = LazyModule(lambda: __import__("tempfile"))
+webbrowser = LazyModule(lambda: __import__("webbrowser"))
+
 # global variables
 options = None
 ws2 = None
+cassette = None
+manifest = {}           # disc ID -> release, fetched from --manifest
+report = None           # DuplicateReport with --report
+isrc_index = None       # IsrcIndex, opened once per run
 logger = logging.getLogger("isrcsubmit")
 
 def script_version():
     return "isrcsubmit %s by JonnyJD for MusicBrainz" % __version__
 
+def script_name():
+    if os.path.isfile(SHELLNAME):
+        return SHELLNAME
+    else:
+        return os.path.basename(sys.argv[0])
+
 def print_help(option=None, opt=None, value=None, parser=None):
     print("%s" % script_version())
     print(\
@@ -114,6 +207,8 @@ Please report bugs on https://github.com/JonnyJD/musicbrainz-isrcsubmit""")
 
 def print_usage(option=None, opt=None, value=None, parser=None):
     print("%s\n" % script_version())
+    device_option = parser.get_option("--device")
+    device_option.help += " The default is %s." % get_default_device()
     parser.print_help()
     sys.exit(0)
 
@@ -121,11 +216,14 @@ class Isrc(object):
     def __init__(self, isrc, track=None):
         self._id = isrc
         self._tracks = []
+        self._track_ids = set()
         if track is not None:
-            self._tracks.append(track)
+            self.add_track(track)
 
     def add_track(self, track):
-        if track not in self._tracks:
+        # tracks are equal when they have the same id
+        if track["id"] not in self._track_ids:
+            self._track_ids.add(track["id"])
             self._tracks.append(track)
 
     def get_tracks(self):
@@ -170,6 +268,82 @@ class OwnTrack(Track):
     """A track found on an analyzed (own) disc"""
     pass
 
+class ForeignTrack(Track):
+    """A recording with the ISRC that is not on the checked release"""
+    def __init__(self, recording):
+        self._track = {}
+        self._recording = recording
+        self._number = None
+
+    @property
+    def releases(self):
+        """The titles of the releases the recording is on
+        """
+        return ", ".join([release.get("title", release["id"]) for release
+                          in self._recording.get("release-list", [])])
+
+class Compact(object):
+    """Base class of the compact release model
+
+    Only the fields isrcsubmit uses are kept from the web service data.
+    They are still read like the keys of that data,
+    the key "artist-credit-phrase" is the slot artist_credit_phrase.
+    Missing keys are missing slots.
+    """
+    __slots__ = ()
+    children = {}       # slot -> class of the entries in that list
+
+    def __init__(self, data):
+        for slot in self.__slots__:
+            key = slot.replace("_", "-")
+            if key in data:
+                value = data[key]
+                if slot in self.children:
+                    value = [self.children[slot](entry) for entry in value]
+                setattr(self, slot, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key.replace("-", "_"))
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key.replace("-", "_"), value)
+
+    def __contains__(self, key):
+        return hasattr(self, key.replace("-", "_"))
+
+    def get(self, key, default=None):
+        return getattr(self, key.replace("-", "_"), default)
+
+class CompactDisc(Compact):
+    __slots__ = ("id",)
+
+class CompactRecording(Compact):
+    __slots__ = ("id", "title", "artist_credit_phrase", "isrc_list")
+
+class CompactTrack(Compact):
+    __slots__ = ("position", "length", "recording")
+
+    def __init__(self, track):
+        Compact.__init__(self, track)
+        if "recording" in track:
+            self.recording = CompactRecording(track["recording"])
+
+class CompactMedium(Compact):
+    __slots__ = ("disc_list", "track_list")
+    children = {"disc_list": CompactDisc, "track_list": CompactTrack}
+
+class CompactLabelInfo(Compact):
+    __slots__ = ("catalog_number",)
+
+class CompactRelease(Compact):
+    __slots__ = ("id", "title", "artist_credit_phrase", "status", "date",
+                 "country", "barcode", "label_info_list", "medium_list")
+    children = {"label_info_list": CompactLabelInfo,
+                "medium_list": CompactMedium}
+
 def get_config_home():
     """Returns the base directory for isrcsubmit's configuration files."""
 
@@ -186,16 +360,549 @@ def config_path():
 
     return os.path.join(get_config_home(), "config")
 
-def gather_options(argv):
-    global options
+def open_database(name, schema):
+    """Opens an SQLite database in isrcsubmit's configuration directory.
+
+    The database is created with the given schema if necessary.
+    """
+    config_home = get_config_home()
+    if not os.path.isdir(config_home):
+        os.makedirs(config_home)
+    # the connection is shared between threads, but guarded by a lock
+    connection = sqlite3.connect(os.path.join(config_home, name),
+                                 check_same_thread=False)
+    connection.executescript(schema)
+    return connection
+
+
+class ReleaseCache(object):
+    """A persistent cache for the web service lookups.
+
+    Entries expire after their time to live and the least recently used
+    entries are removed when the cache is full.
+    Every entry knows which releases it contains,
+    so it can be invalidated when one of these is changed.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS lookup (
+            key TEXT PRIMARY KEY,
+            releases TEXT NOT NULL,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL,
+            used REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS lookup_used ON lookup (used);
+        """
+
+    def __init__(self, name="cache.db", ttl=CACHE_TTL,
+                 negative_ttl=CACHE_NEGATIVE_TTL, size=CACHE_SIZE):
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._size = size
+        self._lock = threading.Lock()
+        self._db = open_database(name, self.schema)
+        with self._lock:
+            self._db.execute("DELETE FROM lookup WHERE expires < ?",
+                             (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def file_name(server):
+        """Returns the name of the cache for the lookups on the server
+        """
+        return "cache-%s.db" % re.sub(r"[^A-Za-z0-9.-]", "_", server)
+
+    @staticmethod
+    def key(entity, entity_id, includes=[], ws_format="xml"):
+        return "%s/%s?inc=%s&fmt=%s" % (entity, entity_id,
+                                        "+".join(sorted(includes)), ws_format)
+
+    def get(self, key):
+        """Returns the cached data or None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                    "SELECT data FROM lookup WHERE key = ? AND expires >= ?",
+                    (key, now)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE lookup SET used = ? WHERE key = ?",
+                             (now, key))
+            self._db.commit()
+        logger.debug("cache hit for %s", key)
+        return json.loads(row[0])
+
+    def put(self, key, data, release_ids, negative=False):
+        """Stores the data for a lookup
+
+        Negative results (nothing found) are kept for a shorter time.
+        """
+        now = time.time()
+        if negative:
+            expires = now + self._negative_ttl
+        else:
+            expires = now + self._ttl
+        # the release IDs are separated and surrounded by spaces
+        releases = " %s " % " ".join(release_ids)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO lookup"
+                             " VALUES (?, ?, ?, ?, ?)",
+                             (key, releases, json.dumps(data), expires, now))
+            # remove the least recently used entries
+            self._db.execute("DELETE FROM lookup WHERE key IN"
+                             " (SELECT key FROM lookup ORDER BY used DESC"
+                             "  LIMIT -1 OFFSET ?)", (self._size,))
+            self._db.commit()
+
+    def patch(self, release_id, function, entities):
+        """Changes the data of the entries containing the release
+        that are lookups of one of the entities
+
+        The function gets the data of every entry and changes it in place.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT key, data FROM lookup"
+                                    " WHERE releases LIKE ?",
+                                    ("%% %s %%" % release_id,)).fetchall()
+            for key, data in rows:
+                if key.split("/", 1)[0] not in entities:
+                    continue
+                data = json.loads(data)
+                function(data)
+                self._db.execute("UPDATE lookup SET data = ? WHERE key = ?",
+                                 (json.dumps(data), key))
+            self._db.commit()
+
+    def invalidate(self, release_id):
+        """Removes all entries containing the release
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM lookup WHERE releases LIKE ?",
+                             ("%% %s %%" % release_id,))
+            self._db.commit()
+
+    def forget(self, entity, entity_id):
+        """Removes the lookups of the entity with all includes
+        """
+        prefix = "%s/%s?" % (entity, entity_id)
+        with self._lock:
+            self._db.execute("DELETE FROM lookup WHERE substr(key, 1, ?) = ?",
+                             (len(prefix), prefix))
+            self._db.commit()
+
+
+class Journal(object):
+    """ISRCs recorded for a later submission.
+
+    Every (recording, ISRC) pair is kept with the disc ID and release
+    it was found for, until it is submitted.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS submission (
+            id INTEGER PRIMARY KEY,
+            recording TEXT NOT NULL,
+            isrc TEXT NOT NULL,
+            disc_id TEXT NOT NULL,
+            release TEXT NOT NULL,
+            recorded REAL NOT NULL,
+            submitted REAL);
+        CREATE INDEX IF NOT EXISTS submission_submitted
+            ON submission (submitted);
+        """
+
+    def __init__(self, name="journal.db"):
+        self._db = open_database(name, self.schema)
+
+    def record(self, tracks2isrcs, disc_id, release_id):
+        now = time.time()
+        self._db.executemany("INSERT INTO submission"
+                             " (recording, isrc, disc_id, release, recorded)"
+                             " VALUES (?, ?, ?, ?, ?)",
+                             [(track_id, isrc, disc_id, release_id, now)
+                              for track_id, isrc in tracks2isrcs.items()])
+        self._db.commit()
+
+    def pending(self):
+        """Returns (id, recording, isrc, release) for every ISRC
+        that wasn't submitted yet
+        """
+        return self._db.execute("SELECT id, recording, isrc, release"
+                                " FROM submission WHERE submitted IS NULL"
+                                " ORDER BY id").fetchall()
+
+    def mark_submitted(self, entry_ids):
+        now = time.time()
+        self._db.executemany("UPDATE submission SET submitted = ?"
+                             " WHERE id = ?",
+                             [(now, entry_id) for entry_id in entry_ids])
+        self._db.commit()
+
+
+class IsrcIndex(object):
+    """Every ISRC found on a disc, with the recording it was found for.
+
+    The ISRCs of all processed discs are kept, so recordings sharing an
+    ISRC are found without the web service.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS seen (
+            isrc TEXT NOT NULL,
+            recording TEXT NOT NULL,
+            release TEXT NOT NULL,
+            disc_id TEXT NOT NULL,
+            backend TEXT NOT NULL,
+            seen REAL NOT NULL,
+            PRIMARY KEY (isrc, recording, release, disc_id));
+        """
+
+    def __init__(self, name="isrcs.db"):
+        self._db = open_database(name, self.schema)
+
+    def record(self, isrcs, disc_id, release_id, backend):
+        """Records the recordings the ISRCs were found for on the disc
+        """
+        now = time.time()
+        entries = []
+        for isrc in isrcs:
+            for track in isrcs[isrc].get_tracks():
+                entries.append((isrc, track["id"], release_id, disc_id,
+                                backend, now))
+        self._db.executemany("INSERT OR REPLACE INTO seen"
+                             " (isrc, recording, release, disc_id, backend,"
+                             " seen) VALUES (?, ?, ?, ?, ?, ?)", entries)
+        self._db.commit()
+
+    def lookup(self, isrc):
+        """Returns (recording, release, disc ID, backend, time)
+        for every time the ISRC was seen
+        """
+        return self._db.execute("SELECT recording, release, disc_id,"
+                                " backend, seen FROM seen WHERE isrc = ?"
+                                " ORDER BY recording, seen",
+                                (isrc,)).fetchall()
+
+    def recordings(self, isrc):
+        """Returns the recordings the ISRC was seen for,
+        in the structure of the web service with the releases
+        """
+        recordings = {}
+        for recording_id, release_id, disc_id, backend, seen \
+                in self.lookup(isrc):
+            recording = recordings.setdefault(recording_id, {
+                    "id": recording_id, "release-list": []})
+            release = {"id": release_id}
+            if release not in recording["release-list"]:
+                recording["release-list"].append(release)
+        return [recordings[recording_id]
+                for recording_id in sorted(recordings)]
+
+
+class OfflineIndex(object):
+    """Releases imported from a MusicBrainz JSON dump.
+
+    The releases are stored compressed in the structure musicbrainzngs
+    returns, with an index of the disc IDs on them.
+    The index knows the server the dump is from.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS release (
+            id TEXT PRIMARY KEY,
+            data BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS disc (
+            id TEXT NOT NULL,
+            release TEXT NOT NULL,
+            PRIMARY KEY (id, release));
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL);
+        """
+
+    def __init__(self, name="index.db"):
+        self._lock = threading.Lock()
+        self._db = open_database(name, self.schema)
+
+    @staticmethod
+    def exists(name="index.db"):
+        return os.path.isfile(os.path.join(get_config_home(), name))
+
+    @staticmethod
+    def dump_lines(path):
+        """Yields the lines of a dump file
+        or of mbdump/release in a dump archive.
+        """
+        if tarfile.is_tarfile(path):
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.name == "mbdump/release":
+                        for line in archive.extractfile(member):
+                            yield line
+                        break
+        else:
+            with open(path, "rb") as dump:
+                for line in dump:
+                    yield line
+
+    def server(self):
+        """Returns the server the releases are from
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta"
+                                   " WHERE key = 'server'").fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def import_dump(self, path, server):
+        """Imports the releases in the dump, one JSON release per line.
+
+        Returns the number of releases imported.
+        """
+        count = 0
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value)"
+                             " VALUES ('server', ?)", (server,))
+            for line in self.dump_lines(path):
+                if not line.strip():
+                    continue
+                release = from_json(json.loads(line.decode("utf-8")))
+                data = zlib.compress(json.dumps(release).encode("utf-8"))
+                self._db.execute("INSERT OR REPLACE INTO release (id, data)"
+                                 " VALUES (?, ?)",
+                                 (release["id"], sqlite3.Binary(data)))
+                for medium in release.get("medium-list", []):
+                    for disc in medium.get("disc-list", []):
+                        self._db.execute("INSERT OR IGNORE INTO disc"
+                                         " (id, release) VALUES (?, ?)",
+                                         (disc["id"], release["id"]))
+                count += 1
+                if count % 1000 == 0:
+                    self._db.commit()
+                    logger.info("imported %d releases", count)
+            self._db.commit()
+        return count
+
+    def release(self, release_id):
+        """Returns the release, None if it is not in the index
+        """
+        with self._lock:
+            row = self._db.execute("SELECT data FROM release WHERE id = ?",
+                                   (release_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(bytes(row[0])).decode("utf-8"))
+
+    def remove(self, release_id):
+        """Removes the release, it is looked up on the server again
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM release WHERE id = ?",
+                             (release_id,))
+            self._db.execute("DELETE FROM disc WHERE release = ?",
+                             (release_id,))
+            self._db.commit()
+
+    def patch(self, release_id, function):
+        """Changes the release with the function, which changes it in place
+        """
+        release = self.release(release_id)
+        if release is None:
+            return
+        function(release)
+        data = zlib.compress(json.dumps(release).encode("utf-8"))
+        with self._lock:
+            self._db.execute("UPDATE release SET data = ? WHERE id = ?",
+                             (sqlite3.Binary(data), release_id))
+            self._db.commit()
+
+    def releases_by_discid(self, disc_id):
+        """Returns the releases with the disc ID,
+        None if the disc ID is not in the index
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT release.data FROM disc JOIN"
+                                    " release ON disc.release = release.id"
+                                    " WHERE disc.id = ? ORDER BY release.id",
+                                    (disc_id,)).fetchall()
+        if not rows:
+            return None
+        return [json.loads(zlib.decompress(bytes(row[0])).decode("utf-8"))
+                for row in rows]
+
+
+class Replayed(object):
+    """An object rebuilt from its recorded attributes
+    """
+
+    def __init__(self, attributes):
+        self.__dict__.update(attributes)
+
+class Cassette(object):
+    """Web requests, disc reads and backend output of a run,
+    recorded with their timing to be replayed later.
+
+    Every interaction is a line in cassette.jsonl in the directory.
+    Interactions of the same kind and key are replayed in the recorded
+    order and take as long as they did when recorded.
+    """
 
+    file_name = "cassette.jsonl"
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replay = replay
+        self._lock = threading.Lock()
+        self._entries = {}      # (kind, key) -> entries not replayed yet
+        self._file_path = os.path.join(path, self.file_name)
+        if replay:
+            with open(self._file_path, "r") as cassette_file:
+                for line in cassette_file:
+                    entry = json.loads(line)
+                    self._entries.setdefault((entry["kind"], entry["key"]),
+                                             []).append(entry)
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            # start a new recording
+            open(self._file_path, "w").close()
+            self._write({"kind": "run", "key": script_version(),
+                         "backend": options.backend})
+
+    @classmethod
+    def recorded_backend(cls, path):
+        """Returns the backend used for the recording
+        """
+        with open(os.path.join(path, cls.file_name), "r") as cassette_file:
+            return json.loads(cassette_file.readline())["backend"]
+
+    def _write(self, entry):
+        # every interaction is written, even when the run is aborted
+        with self._lock:
+            with open(self._file_path, "a") as cassette_file:
+                cassette_file.write(json.dumps(entry) + "\n")
+
+    def _next(self, kind, key):
+        with self._lock:
+            entries = self._entries.get((kind, key))
+            if entries:
+                return entries.pop(0)
+        print_error("Not recorded: %s %s" % (kind, key))
+        sys.exit(1)
+
+    @staticmethod
+    def _dump_error(err):
+        if isinstance(err, discid.DiscError):
+            return {"type": "DiscError", "message": str(err)}
+        return {"type": err.__class__.__name__, "message": err.msg,
+                "code": getattr(err.cause, "code", None)}
+
+    @staticmethod
+    def _load_error(error):
+        if error["type"] == "DiscError":
+            return discid.DiscError(error["message"])
+        cause = None
+        if error["code"] is not None:
+            cause = urllib_request.HTTPError(None, error["code"],
+                                             error["message"], {}, None)
+        error_class = getattr(musicbrainzngs, error["type"],
+                              musicbrainzngs.WebServiceError)
+        return error_class(error["message"], cause)
+
+    def call(self, kind, key, function, dump=None, load=None):
+        """Returns the result of the function, which is called
+        when recording and replayed otherwise.
+
+        Results that can't be stored as JSON are converted with dump()
+        and rebuilt with load().
+        """
+        if self.replay:
+            entry = self._next(kind, key)
+            time.sleep(entry["duration"])
+            if "error" in entry:
+                raise self._load_error(entry["error"])
+            elif load is not None:
+                return load(entry["result"])
+            else:
+                return entry["result"]
+        start = time.time()
+        try:
+            result = function()
+        except (discid.DiscError, musicbrainzngs.WebServiceError) as err:
+            self._write({"kind": kind, "key": key,
+                         "duration": time.time() - start,
+                         "error": self._dump_error(err)})
+            raise
+        if dump is None:
+            recorded = result
+        else:
+            recorded = dump(result)
+        self._write({"kind": kind, "key": key,
+                     "duration": time.time() - start, "result": recorded})
+        return result
+
+    def stream(self, kind, key, output, dump=None, load=None):
+        """Yields the items the output() generator yields when recording,
+        the replayed items otherwise, with the recorded timing.
+        """
+        if self.replay:
+            for delay, item in self._next(kind, key)["items"]:
+                time.sleep(delay)
+                if load is None:
+                    yield item
+                else:
+                    yield load(item)
+            return
+        items = []
+        start = last = time.time()
+        for item in output():
+            now = time.time()
+            if dump is None:
+                items.append((now - last, item))
+            else:
+                items.append((now - last, dump(item)))
+            last = now
+            yield item
+        self._write({"kind": kind, "key": key, "duration": last - start,
+                     "items": items})
+
+def dump_disc(disc):
+    return {"id": disc.id, "submission_url": disc.submission_url,
+            "mcn": getattr(disc, "mcn", None),
+            "tracks": [{"number": track.number,
+                        "sectors": getattr(track, "sectors", None),
+                        "isrc": getattr(track, "isrc", None)}
+                       for track in disc.tracks]}
+
+def load_disc(data):
+    disc = Replayed(data)
+    disc.tracks = [Replayed(track) for track in data["tracks"]]
+    return disc
+
+def read_discid(device, features=[]):
+    """Reads the disc in the device with libdiscid
+    or replays the recorded disc
+    """
+    if cassette is None:
+        return discid.read(device, features=features)
+    return cassette.call("disc", " ".join([device] + features),
+                         lambda: discid.read(device, features=features),
+                         dump=dump_disc, load=load_disc)
+
+
+def get_default_device():
     if sys.platform == "darwin":
         # That is the device drutil expects and stable
         # /dev/rdisk1 etc. change with multiple hard disks, dmgs mounted etc.
         # libdiscid < 0.6.0 can't handle drive numbers
-        default_device = "1"
+        return "1"
     else:
-        default_device = discid.get_default_device()
+        return discid.get_default_device()
+
+def gather_options(argv):
+    global options
 
     config = ConfigParser()
     config.read(config_path())
@@ -203,7 +910,7 @@ def gather_options(argv):
     parser = OptionParser(version=script_version(), add_help_option=False)
     parser.set_usage(
             "{prog} [options] [user] [device]\n       {prog} -h".format(
-            prog=SCRIPTNAME))
+            prog=script_name()))
     parser.add_option("-h", action="callback", callback=print_usage,
             help="Short usage help")
     parser.add_option("--help", action="callback", callback=print_help,
@@ -212,11 +919,19 @@ def gather_options(argv):
             help="MusicBrainz username, if not given as argument.")
     # note that -d previously stand for debug
     parser.add_option("-d", "--device", metavar="DEVICE",
-            help="CD device with a loaded audio cd, if not given as argument."
-            + " The default is %s." % default_device)
+            help="CD device with a loaded audio cd, if not given as argument.")
+    parser.add_option("--devices", metavar="DEVICES",
+            help="Comma separated list of CD devices."
+            + " All of them are read at the same time.")
+    parser.add_option("--all-drives", action="store_true", default=False,
+            help="Read the discs in all CD drives found at the same time.")
     parser.add_option("--release-id", metavar="RELEASE_ID",
             help="Optional MusicBrainz ID of the release."
             + " This will be gathered if not given.")
+    parser.add_option("--manifest", metavar="FILE",
+            help="File with a disc ID and the MusicBrainz ID of its release"
+            + " on every line. The releases are fetched before any disc"
+            + " is read.")
     parser.add_option("-b", "--backend", choices=BACKENDS, metavar="PROGRAM",
             help="Force using a specific backend to extract ISRCs from the"
             + " disc. Possible backends are: %s." % ", ".join(BACKENDS)
@@ -228,6 +943,61 @@ def gather_options(argv):
             help="Always open TOC/disc ID in browser.")
     parser.add_option("--server", metavar="SERVER",
             help="Server to send ISRCs to. Default: %s" % DEFAULT_SERVER)
+    parser.add_option("--lookup-server", metavar="SERVER",
+            help="Server for the lookups, like a local mirror."
+            + " It is not rate limited. Default: the server ISRCs are sent to")
+    parser.add_option("--ws-format", choices=["xml", "json"], metavar="FORMAT",
+            help="Format of the web service lookups, xml or json."
+            + " Default: xml")
+    parser.add_option("--chunk-size", type="int", metavar="NUMBER",
+            help="Submit the ISRCs of at most this many recordings in one"
+            + " request. Default: %d" % SUBMIT_CHUNK_SIZE)
+    parser.add_option("--verify", action="store_true", default=False,
+            help="Check that the submitted ISRCs are attached afterwards.")
+    parser.add_option("--cache-ttl", type="int", metavar="SECONDS",
+            help="How long web service lookups are cached."
+            + " 0 disables the cache. Default: %d" % CACHE_TTL)
+    parser.add_option("--journal", action="store_true", default=None,
+            help="Record the ISRCs in a local journal instead of submitting"
+            + " them. Use --flush-journal to submit them later.")
+    parser.add_option("--flush-journal", action="store_true", default=False,
+            help="Submit all ISRCs recorded in the journal and exit.")
+    parser.add_option("--query-isrc", metavar="ISRC",
+            help="Show the recordings and discs the ISRC was found for"
+            + " in earlier runs and exit.")
+    parser.add_option("--import-dump", metavar="FILE",
+            help="Import the releases of a MusicBrainz JSON dump"
+            + " of the server into the offline index and exit.")
+    parser.add_option("--offline-index", action="store_true", default=None,
+            help="Answer lookups from the offline index when possible.")
+    parser.add_option("--record", metavar="DIR",
+            help="Record the web requests, disc reads and backend output"
+            + " with their timing in the directory.")
+    parser.add_option("--replay", metavar="DIR",
+            help="Replay a run recorded with --record instead of using"
+            + " the web service, the drive and the backend.")
+    parser.add_option("--prefetch", type="int", metavar="NUMBER",
+            default=0,
+            help="Show the choice for ambiguous disc IDs before the"
+            + " recordings are looked up and fetch them for this many"
+            + " releases in the background. Default: 0")
+    parser.add_option("--auto-select", type="float", metavar="SCORE",
+            help="Choose from ambiguous releases without asking when the"
+            + " best matches the disc with this score (0 to 1)."
+            + " Other discs are queued for review.")
+    parser.add_option("--review", metavar="FILE",
+            help="File the discs are queued in for review."
+            + " Default: review.txt in the configuration directory")
+    parser.add_option("--check-isrcs", action="store_true", default=False,
+            help="Look up every ISRC found to also find the duplicates"
+            + " on other releases.")
+    parser.add_option("--report", metavar="FILE",
+            help="Write the duplicate ISRCs to a JSON report, or an HTML"
+            + " report if FILE ends with .html, instead of asking to clean"
+            + " them up. Duplicates are added to an existing report.")
+    parser.add_option("--brief", action="store_true", default=False,
+            help="Don't show the artists and labels of the releases."
+            + " The lookups are smaller and faster then.")
     parser.add_option("--debug", action="store_true", default=False,
             help="Show debug messages."
             + " Currently shows some backend messages.")
@@ -251,6 +1021,11 @@ def gather_options(argv):
 
     # If an option is set in the config and not overriden on the command line,
     # assign them to options.
+    if options.journal is None and config.has_option("general", "journal"):
+        options.journal = config.getboolean("general", "journal")
+    if (options.offline_index is None
+            and config.has_option("cache", "offline_index")):
+        options.offline_index = config.getboolean("cache", "offline_index")
     if options.keyring is None and config.has_option("general", "keyring"):
         options.keyring = config.getboolean("general", "keyring")
     if options.backend is None and config.has_option("general", "backend"):
@@ -261,65 +1036,157 @@ def gather_options(argv):
             sys.exit(-1)
     if options.browser is None and config.has_option("general", "browser"):
         options.browser = config.get("general", "browser")
+    if (options.devices is None and options.device is None
+            and config.has_option("general", "devices")):
+        options.devices = config.get("general", "devices")
     if options.device is None and config.has_option("general", "device"):
         options.device = config.get("general", "device")
     if options.server is None and config.has_option("musicbrainz", "server"):
         options.server = config.get("musicbrainz", "server")
+    if (options.lookup_server is None
+            and config.has_option("musicbrainz", "lookup_server")):
+        options.lookup_server = config.get("musicbrainz", "lookup_server")
     if options.user is None and config.has_option("musicbrainz", "user"):
         options.user = config.get("musicbrainz", "user")
+    if (options.ws_format is None
+            and config.has_option("musicbrainz", "format")):
+        options.ws_format = config.get("musicbrainz", "format")
+        if options.ws_format not in ["xml", "json"]:
+            print_error("Format given in config file is not a valid choice.",
+                        "Choose xml or json")
+            sys.exit(-1)
+    if (options.chunk_size is None
+            and config.has_option("musicbrainz", "chunk_size")):
+        options.chunk_size = config.getint("musicbrainz", "chunk_size")
+    if options.cache_ttl is None and config.has_option("cache", "ttl"):
+        options.cache_ttl = config.getint("cache", "ttl")
+    options.cache_negative_ttl = CACHE_NEGATIVE_TTL
+    if config.has_option("cache", "negative_ttl"):
+        options.cache_negative_ttl = config.getint("cache", "negative_ttl")
+    options.cache_size = CACHE_SIZE
+    if config.has_option("cache", "size"):
+        options.cache_size = config.getint("cache", "size")
 
     # assign remaining options automatically
+    default_device = get_default_device()
     if options.device is None:
         options.device = default_device
-    options.sane_which = test_which()
+    if options.all_drives:
+        options.devices = find_drives(default_device)
+    elif options.devices:
+        options.devices = [device.strip()
+                           for device in options.devices.split(",")
+                           if device.strip()]
+    else:
+        options.devices = [options.device]
+    if options.browser is None or not options.backend:
+        found_backend, found_browser = find_programs()
     if options.browser is None:
-        options.browser = find_browser()
+        options.browser = found_browser
     if options.server is None:
         options.server = DEFAULT_SERVER
+    if options.lookup_server is None:
+        options.lookup_server = options.server
     if options.keyring is None:
         options.keyring = True
-    if options.backend and not has_program(options.backend, strict=True):
+    if options.ws_format is None:
+        options.ws_format = "xml"
+    if options.cache_ttl is None:
+        options.cache_ttl = CACHE_TTL
+    if options.chunk_size is None:
+        options.chunk_size = SUBMIT_CHUNK_SIZE
+    elif options.chunk_size < 1:
+        print_error("The chunk size has to be at least 1.")
+        sys.exit(-1)
+    if options.journal is None:
+        options.journal = False
+    if options.offline_index is None:
+        options.offline_index = False
+    if options.review is None:
+        options.review = os.path.join(get_config_home(), "review.txt")
+    if options.auto_select is not None and not 0 <= options.auto_select <= 1:
+        print_error("The score for --auto-select is between 0 and 1.")
+        sys.exit(-1)
+    if options.record and options.replay:
+        print_error("--record and --replay can't be used together.")
+        sys.exit(-1)
+    if options.record or options.replay:
+        # every lookup has to be a web request
+        options.cache_ttl = 0
+    if options.replay and not os.path.isfile(
+            os.path.join(options.replay, Cassette.file_name)):
+        print_error("No recorded run found in %s" % options.replay)
+        sys.exit(-1)
+    if options.replay and not options.backend:
+        options.backend = Cassette.recorded_backend(options.replay)
+    if (options.backend and not options.replay
+            and not get_backend(options.backend).available(strict=True)):
         print_error("Chosen backend not found. No ISRC extraction possible!",
                     "Make sure that %s is installed." % options.backend)
         sys.exit(-1)
-    elif not options.backend:
-        options.backend = find_backend()
+    elif (not options.backend and not options.flush_journal
+            and not options.query_isrc and not options.import_dump):
+        if found_backend is None:
+            print_error("Cannot find a backend to extract the ISRCS!",
+                        "Isrcsubmit can work with one of the following:",
+                        "  " + ", ".join(BACKENDS))
+            sys.exit(-1)
+        options.backend = found_backend
 
     return options
 
 
-def test_which():
-    """There are some old/buggy "which" versions on Windows.
-    We want to know if the user has a "sane" which we can trust.
-    Unxutils has a broken 2.4 version. Which >= 2.16 should be fine.
+def which(program):
+    """Returns the path of the program in PATH, None if it is not found
     """
-    with open(os.devnull, "w") as devnull:
+    extensions = [""]
+    if os.name == "nt":
+        pathext = os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD")
+        extensions += pathext.lower().split(os.pathsep)
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        directory = directory.strip('"')
+        for extension in extensions:
+            program_path = os.path.join(directory, program + extension)
+            if (os.path.isfile(program_path)
+                    and os.access(program_path, os.X_OK)):
+                return program_path
+    return None
+
+def find_drives(default_device):
+    """Returns the CD drives found on this system
+
+    The default device is used when no drives can be detected.
+    """
+    drives = []
+    if sys.platform.startswith("linux"):
         try:
-            # "which" should at least find itself
-            return_code = call(["which", "which"],
-                               stdout=devnull, stderr=devnull)
-        except OSError:
-            return False        # no which at all
-        else:
-            if (return_code == 0):
-                return True
-            else:
-                print('warning: your version of the tool "which"'
-                      ' is buggy/outdated')
-                if os.name == "nt":
-                    print('         unxutils is old/broken, GnuWin32 is good.')
-                return False
+            with open("/proc/sys/dev/cdrom/info", "r") as info:
+                for line in info:
+                    if line.startswith("drive name:"):
+                        names = line.split(":", 1)[1].split()
+                        drives = ["/dev/%s" % name for name in names]
+                        break
+        except IOError:
+            pass
+        drives.sort()   # the kernel lists the latest drive first
+    elif os.name == "nt":
+        import ctypes
+        import string
+        for letter in string.ascii_uppercase:
+            root = unicode_string("%s:\\" % letter)
+            if ctypes.windll.kernel32.GetDriveTypeW(root) == 5: # DRIVE_CDROM
+                drives.append("%s:" % letter)
+
+    if not drives:
+        logger.warning("No CD drives found, using %s", default_device)
+        drives = [default_device]
+    return drives
 
 def get_prog_version(prog):
-    if prog == "libdiscid":
-        version = discid.LIBDISCID_VERSION_STRING
-    elif prog == "cdrdao":
-        outdata = Popen([prog], stderr=PIPE).communicate()[1]
-        version = b" ".join(outdata.splitlines()[0].split()[::2][0:2])
-    else:
-        version = prog
-
-    return decode(version)
+    if cassette is not None:
+        return cassette.call("version", prog,
+                             lambda: decode(get_backend(prog).version()))
+    return decode(get_backend(prog).version())
 
 def has_program(program, strict=False):
     """When the backend is only a symlink to another backend,
@@ -328,51 +1195,27 @@ def has_program(program, strict=False):
     if program == "libdiscid":
         return "isrc" in discid.FEATURES
 
-    with open(os.devnull, "w") as devnull:
-        if options.sane_which:
-            p_which = Popen(["which", program], stdout=PIPE, stderr=devnull)
-            program_path = p_which.communicate()[0].strip()
-            if p_which.returncode == 0:
-                # check if it is only a symlink to another backend
-                real_program = os.path.basename(os.path.realpath(program_path))
-                if program != real_program and (
-                        real_program in BACKENDS or real_program in BROWSERS):
-                    if strict:
-                        print("WARNING: %s is a symlink to %s"
-                              % (program, real_program))
-                        return True
-                    else:
-                        return False # use real program (target) instead
-                return True
-            else:
-                return False
-        elif program in BACKENDS:
-            try:
-                # we just try to start these non-interactive console apps
-                call([program], stdout=devnull, stderr=devnull)
-            except OSError:
-                return False
-            else:
-                return True
+    program_path = which(program)
+    if program_path is None:
+        return False
+    # check if it is only a symlink to another backend
+    real_program = os.path.basename(os.path.realpath(program_path))
+    if program != real_program and (
+            real_program in BACKENDS or real_program in BROWSERS):
+        if strict:
+            print("WARNING: %s is a symlink to %s" % (program, real_program))
+            return True
         else:
-            return False
+            return False # use real program (target) instead
+    return True
 
 def find_backend():
-    """search for an available backend
+    """search for an available backend, None if there is none
     """
-    backend = None
     for prog in BACKENDS:
-        if has_program(prog):
-            backend = prog
-            break
-
-    if backend is None:
-        print_error("Cannot find a backend to extract the ISRCS!",
-                    "Isrcsubmit can work with one of the following:",
-                    "  " + ", ".join(BACKENDS))
-        sys.exit(-1)
-
-    return backend
+        if get_backend(prog).available():
+            return prog
+    return None
 
 def find_browser():
     """search for an available browser
@@ -384,11 +1227,60 @@ def find_browser():
     # This will use the webbrowser module to find a default
     return None
 
+def program_state(program_paths):
+    """Describes everything the search for programs depends on.
+
+    Installing or removing a program changes the modification time
+    of its directory in PATH.
+    """
+    directories = os.environ.get("PATH", os.defpath).split(os.pathsep)
+    mtimes = []
+    for path in directories + program_paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return {"path": os.environ.get("PATH", os.defpath),
+            "mtimes": mtimes,
+            "libdiscid": discid.LIBDISCID_VERSION_STRING}
+
+def find_programs():
+    """Returns the backend and browser found (or None for each)
+
+    The result is saved in the configuration directory and only searched
+    for again when PATH or the programs found changed.
+    """
+    state_path = os.path.join(get_config_home(), "programs.json")
+    try:
+        with open(state_path, "r") as state_file:
+            saved = json.load(state_file)
+        if saved["state"] == program_state(saved["paths"]):
+            return saved["backend"], saved["browser"]
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    backend = find_backend()
+    browser = find_browser()
+    paths = [which(program) for program in [backend, browser] if program]
+    paths = [path for path in paths if path is not None]
+    saved = {"backend": backend, "browser": browser,
+             "paths": paths, "state": program_state(paths)}
+    try:
+        if not os.path.isdir(get_config_home()):
+            os.makedirs(get_config_home())
+        with open(state_path, "w") as state_file:
+            json.dump(saved, state_file)
+    except (IOError, OSError) as err:
+        logger.debug("Couldn't save the programs found: %s", err)
+    return backend, browser
+
 def open_browser(url, exit=False, submit=False):
     """open url in the selected browser, default if none
     """
     if options.browser:
         if exit:
+            # nothing is cleaned up after the browser replaced us
+            stop_extractions()
             try:
                 if os.name == "nt":
                     # silly but necessary for spaces in the path
@@ -453,8 +1345,6 @@ def cp65001(name):
     if name.lower() == "cp65001":
         return codecs.lookup("utf-8")
 
-codecs.register(cp65001)
-
 def printf(format_string, *args):
     """Print with the % and without additional spaces or newlines
     """
@@ -506,7 +1396,9 @@ def print_release(release, position=None):
     country = (release.get("country") or "").ljust(2)
     date = (release.get("date") or "").ljust(10)
     barcode = (release.get("barcode") or "").rjust(13)
-    label_list = release["label-info-list"]
+    # artists and labels are not looked up with --brief
+    artist = release.get("artist-credit-phrase")
+    label_list = release.get("label-info-list", [])
     catnumber_list = []
     for label in label_list:
         cat_number = label.get("catalog-number")
@@ -515,12 +1407,15 @@ def print_release(release, position=None):
     catnumbers = ", ".join(catnumber_list)
 
     if position is None:
-        print_encoded("Artist:\t\t%s\n" % release["artist-credit-phrase"])
+        if artist:
+            print_encoded("Artist:\t\t%s\n" % artist)
         print_encoded("Release:\t%s" % release["title"])
     else:
         print_encoded("%#2d:" % position)
-        print_encoded("%s - %s" % (
-                      release["artist-credit-phrase"], release["title"]))
+        if artist:
+            print_encoded("%s - %s" % (artist, release["title"]))
+        else:
+            print_encoded("%s" % release["title"])
     if release.get("status"):
         print("(%s)" % release["status"])
     else:
@@ -528,7 +1423,8 @@ def print_release(release, position=None):
     if position is None:
         print_encoded("Release Event:\t%s\t%s\n" % (date, country))
         print_encoded("Barcode:\t%s\n" % release.get("barcode") or "")
-        print_encoded("Catalog No.:\t%s\n" % catnumbers)
+        if "label-info-list" in release:
+            print_encoded("Catalog No.:\t%s\n" % catnumbers)
         print_encoded("MusicBrainz ID:\t%s\n" % release["id"])
     else:
         print_encoded("\t%s\t%s\t%s\t%s\n" % (
@@ -544,7 +1440,9 @@ def backend_error(err):
                 % (options.backend, err.errno, err.strerror))
     sys.exit(1)
 
-def ask_for_submission(url, print_url=False):
+def ask_for_submission(url, disc_id, print_url=False):
+    # the next run has to see the disc ID once it is attached
+    ws2.forget_disc(disc_id)
     if options.force_submit:
         submit_requested = True
     else:
@@ -552,11 +1450,305 @@ def ask_for_submission(url, print_url=False):
         submit_requested = user_input(" [y/N] ").lower() == "y"
 
     if submit_requested:
-        open_browser(url, exit=True, submit=True)
+        # the other drives are still handled when there are several
+        open_browser(url, exit=len(options.devices) == 1, submit=True)
     elif print_url:
         print("Please submit the Disc ID with this url:")
         print(url)
 
+class RateLimiter(object):
+    """A token bucket shared by all requests to the server.
+
+    Requests waiting for a token are served by priority,
+    then in the order they arrived.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=1):
+        self._interval = 1.0 / rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._condition = threading.Condition()
+        self._waiting = []      # heap of (priority, arrival)
+        self._arrivals = 0
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens
+                           + (now - self._updated) / self._interval)
+        self._updated = now
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Waits until a request can be sent.
+
+        Returns the number of seconds waited.
+        """
+        start = time.time()
+        with self._condition:
+            ticket = (priority, self._arrivals)
+            self._arrivals += 1
+            heapq.heappush(self._waiting, ticket)
+            # a more urgent request has to recalculate the waiting time
+            self._condition.notify_all()
+            while True:
+                self._refill()
+                if self._waiting[0] != ticket:
+                    self._condition.wait()
+                elif self._tokens < 1:
+                    self._condition.wait((1 - self._tokens) * self._interval)
+                else:
+                    break
+            heapq.heappop(self._waiting)
+            self._tokens -= 1
+            self._condition.notify_all()
+        return time.time() - start
+
+    def pause(self, seconds):
+        """Holds back all requests for the given time,
+        when the server asks to slow down.
+        """
+        with self._condition:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds / self._interval
+            self._condition.notify_all()
+
+
+def request_target(request):
+    """Returns scheme, host and selector of a urllib request
+    """
+    try:
+        return request.type, request.host, request.selector
+    except AttributeError:
+        # Python 2
+        return request.get_type(), request.get_host(), request.get_selector()
+
+def server_error(err):
+    """Returns the HTTP status of a temporary server error, otherwise None
+    """
+    code = getattr(getattr(err, "cause", err), "code", None)
+    if code in SERVER_ERRORS:
+        return code
+    return None
+
+class Unlocked(object):
+    """A lock that never blocks
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Transport(object):
+    """Keeps connections to the web service open between requests
+    and asks for gzip compressed responses.
+
+    Once installed, every request musicbrainzngs makes uses the transport.
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._idle = {}         # (scheme, host) -> idle connections
+        self._lock = threading.Lock()
+        self._route = threading.local()
+        self.connections = 0
+        self.requests = 0
+        self.bytes_received = 0     # response bodies as sent by the server
+        self.bytes_decoded = 0      # response bodies after decompression
+
+    def install(self):
+        transport = self
+
+        class TransportHandler(urllib_request.HTTPHandler,
+                               urllib_request.HTTPSHandler):
+            def http_open(self, request):
+                response = transport.open(request)
+                if response.code in SERVER_ERRORS:
+                    # retried by WebService2, not by musicbrainzngs
+                    raise musicbrainzngs.NetworkError(
+                            cause=urllib_request.HTTPError(
+                                    response.geturl(), response.code,
+                                    response.msg, response.info(), None))
+                return response
+
+            https_open = http_open
+
+        # musicbrainzngs builds a new opener with a new handler per request
+        musicbrainzngs.compat.HTTPHandler = \
+                lambda debuglevel=0: TransportHandler()
+
+    def route(self, host):
+        """Sends the requests of the current thread to the host
+        instead of the one musicbrainzngs addresses, None stops that.
+        """
+        self._route.host = host
+
+    def _connection(self, scheme, host):
+        """Returns an idle connection to the host or a new one
+        and if it was used before
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+            self.connections += 1
+        logger.debug("opening connection to %s", host)
+        if scheme == "https":
+            connection = http_client.HTTPSConnection(host,
+                                                     timeout=self.timeout)
+        else:
+            connection = http_client.HTTPConnection(host, timeout=self.timeout)
+        return connection, False
+
+    def open(self, request):
+        """Sends a urllib request and returns the decoded response
+        """
+        scheme, host, selector = request_target(request)
+        headers = dict(request.header_items())
+        headers["Accept-Encoding"] = "gzip"
+        route = getattr(self._route, "host", None)
+        if route is not None:
+            host = headers["Host"] = route
+        while True:
+            connection, reused = self._connection(scheme, host)
+            try:
+                connection.request(request.get_method(), selector,
+                                   request.data, headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (EnvironmentError, http_client.HTTPException) as err:
+                connection.close()
+                if reused:
+                    # the server closed the idle connection, try a new one
+                    continue
+                raise urllib_request.URLError(err)
+            else:
+                break
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.setdefault((scheme, host), []).append(connection)
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+        if response.getheader("Content-Encoding", "") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            del response.msg["Content-Encoding"]
+        with self._lock:
+            self.bytes_decoded += len(body)
+        result = urllib_request.addinfourl(BytesIO(body), response.msg,
+                                           request.get_full_url(),
+                                           response.status)
+        result.msg = response.reason
+        return result
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+
+
+# the names musicbrainzngs uses for the lists in the ws/2 JSON format
+JSON_LISTS = {"releases": "release-list", "media": "medium-list",
+              "discs": "disc-list", "tracks": "track-list",
+              "isrcs": "isrc-list", "label-info": "label-info-list",
+              "offsets": "offset-list", "recordings": "recording-list"}
+
+def artist_credit_from_json(credits):
+    """Returns the artist credit and the credit phrase
+    """
+    artist_credit = []
+    phrase = ""
+    for credit in credits:
+        artist = from_json(credit["artist"])
+        name = credit.get("name") or artist.get("name", "")
+        if name == artist.get("name"):
+            artist_credit.append({"artist": artist})
+        else:
+            artist_credit.append({"artist": artist, "name": name})
+        phrase += name
+        if credit.get("joinphrase"):
+            artist_credit.append(credit["joinphrase"])
+            phrase += credit["joinphrase"]
+    return artist_credit, phrase
+
+def from_json(data):
+    """Converts an entity in the ws/2 JSON format
+    to the structure musicbrainzngs returns for the XML format.
+    """
+    result = {}
+    for key, value in data.items():
+        if value is None or value == "" or value is False:
+            # these are left out in the XML format
+            continue
+        elif key == "artist-credit":
+            (result[key], result["artist-credit-phrase"]
+                    ) = artist_credit_from_json(value)
+        elif key in JSON_LISTS:
+            result[JSON_LISTS[key]] = [from_json(item)
+                                       if isinstance(item, dict) else item
+                                       for item in value]
+        elif isinstance(value, dict):
+            result[key] = from_json(value)
+        elif value is True:
+            result[key] = "true"
+        elif isinstance(value, (int, float)):
+            result[key] = str(value)
+        else:
+            result[key] = value
+    if "recording" in result and "position" in result:
+        # a track
+        length = result.get("length", result["recording"].get("length"))
+        if length is not None:
+            result["track_or_recording_length"] = length
+    return result
+
+class JsonClient(object):
+    """Web service lookups in the ws/2 JSON format.
+
+    The methods work like those of musicbrainzngs with the same name
+    and return the same structures.
+    """
+
+    def __init__(self, transport, server):
+        self.transport = transport
+        self.server = server
+        self.useragent = "%s/%s ( %s )" % (AGENT_NAME, __version__, AGENT_URL)
+
+    def _get(self, entity, entity_id, includes):
+        url = "http://%s/ws/2/%s/%s?" % (self.server, entity, entity_id)
+        if includes:
+            url += "inc=%s&" % "+".join(includes)
+        url += "fmt=json"
+        request = urllib_request.Request(url, headers={
+                "User-Agent": self.useragent, "Accept": "application/json"})
+        response = self.transport.open(request)
+        if response.code != 200:
+            error = urllib_request.HTTPError(url, response.code, response.msg,
+                                             response.info(), response)
+            if response.code in [400, 404]:
+                raise musicbrainzngs.ResponseError(cause=error)
+            raise error
+        return from_json(json.loads(response.read().decode("utf-8")))
+
+    def get_releases_by_discid(self, disc_id, includes=[]):
+        return {"disc": self._get("discid", disc_id, includes)}
+
+    def get_release_by_id(self, release_id, includes=[]):
+        return {"release": self._get("release", release_id, includes)}
+
+    def get_recordings_by_isrc(self, isrc, includes=[]):
+        result = self._get("isrc", isrc, includes)
+        # the ISRC is the "id" in the XML format
+        return {"isrc": {"id": result.get("isrc", isrc),
+                         "recording-list": result.get("recording-list", [])}}
+
+
 class WebService2():
     """A web service wrapper that asks for a password when first needed.
 
@@ -567,9 +1759,47 @@ class WebService2():
         self.auth = False
         self.keyring_failed = False
         self.username = username
+        if options.cache_ttl > 0:
+            # every server has its own releases and recordings
+            name = ReleaseCache.file_name(options.lookup_server)
+            self.cache = ReleaseCache(name, ttl=options.cache_ttl,
+                                      negative_ttl=options.cache_negative_ttl,
+                                      size=options.cache_size)
+        else:
+            self.cache = None
+        # all requests go through our own rate limiter
+        self.rate_limiter = RateLimiter()
+        # lookups and submissions share the connections
+        # lookups are answered from the offline index when asked for
+        self.index = None
+        if options.offline_index and cassette is None:
+            if not OfflineIndex.exists():
+                logger.warning("There is no offline index,"
+                               " import a dump with --import-dump.")
+            else:
+                index = OfflineIndex()
+                if index.server() == options.server:
+                    self.index = index
+                else:
+                    logger.warning("The offline index is for %s,"
+                                   " it isn't used for %s.",
+                                   index.server(), options.server)
+        self.transport = Transport()
+        self.transport.install()
+        if options.ws_format == "json":
+            self.json_client = JsonClient(self.transport,
+                                          options.lookup_server)
+        else:
+            self.json_client = None
+        musicbrainzngs.set_rate_limit(False)
+        # musicbrainzngs sends one request at a time even without its
+        # rate limit, ours is kept for every thread
+        request = getattr(musicbrainzngs.musicbrainz, "_mb_request", None)
+        if hasattr(request, "lock"):
+            request.lock = Unlocked()
+        # lookups on a mirror are routed there by the transport
         musicbrainzngs.set_hostname(options.server)
-        musicbrainzngs.set_useragent(AGENT_NAME, __version__,
-                "http://github.com/JonnyJD/musicbrainz-isrcsubmit")
+        musicbrainzngs.set_useragent(AGENT_NAME, __version__, AGENT_URL)
 
     def authenticate(self):
         """Sets the password if not set already
@@ -583,7 +1813,10 @@ class WebService2():
                 print("(aborted)")
                 sys.exit(1)
             password = None
-            if keyring is not None and options.keyring and not self.keyring_failed:
+            keyring = None
+            if options.keyring:
+                keyring = import_keyring()
+            if keyring is not None and not self.keyring_failed:
                 password = keyring.get_password(options.server, self.username)
             if password is None:
                 password = getpass.getpass(
@@ -592,70 +1825,351 @@ class WebService2():
             musicbrainzngs.auth(self.username, password)
             self.auth = True
             self.keyring_failed = False
-            if keyring is not None and options.keyring:
+            if keyring is not None:
                 keyring.set_password(options.server, self.username, password)
 
-    def get_releases_by_discid(self, disc_id, includes=[]):
-        try:
-            response = musicbrainzngs.get_releases_by_discid(disc_id,
-                                                             includes=includes)
-        except ResponseError as err:
-            if err.cause.code == 404:
-                return []
-            else:
-                print_error("Couldn't fetch release: %s" % err)
-                sys.exit(1)
-        except WebServiceError as err:
-            print_error("Couldn't fetch release: %s" % err)
-            sys.exit(1)
+    def _on_server(self, server, function):
+        """Returns the musicbrainzngs function
+        making its requests to the server.
+        """
+        if server == options.server:
+            return function
+
+        def on_server(*args, **kwargs):
+            # only this thread is affected, other requests run meanwhile
+            self.transport.route(server)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.transport.route(None)
+        on_server.__name__ = function.__name__
+        return on_server
+
+    def _back_off(self, server, attempt):
+        """Waits before a request is retried, the delay doubles
+        with every attempt.  Requests to the rate limited server
+        are all held back.
+        """
+        delay = SERVER_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+        if server == options.server:
+            self.rate_limiter.pause(delay)
         else:
-            if response.get("disc"):
-                return response["disc"]["release-list"]
-            else:
-                return []
+            time.sleep(delay)
+        return delay
 
-    def get_release_by_id(self, release_id, includes=[]):
+    def _request(self, server, priority, name, function, *args, **kwargs):
+        """Calls the function for the named request
+        when the rate limit of the server allows it.
+
+        Temporary server errors are retried with a growing delay.
+        """
+        attempt = 0
+        while True:
+            if server == options.server:
+                waited = self.rate_limiter.acquire(priority)
+            else:
+                # mirrors are not rate limited
+                waited = 0.0
+            if waited >= 0.01:
+                logger.info("%s waited %.2f s for the rate limit",
+                            name, waited)
+            try:
+                if cassette is None:
+                    return function(*args, **kwargs)
+                # the same requests with XML and JSON
+                key = "%s %s" % (name, json.dumps([args, kwargs],
+                                                  sort_keys=True))
+                return cassette.call("web", key,
+                                     lambda: function(*args, **kwargs))
+            except (musicbrainzngs.WebServiceError, EnvironmentError) as err:
+                if server_error(err) is None or attempt >= SERVER_RETRIES:
+                    raise
+                delay = self._back_off(server, attempt)
+                attempt += 1
+                logger.warning("%s failed, retrying in %.1f s: %s",
+                               name, delay, err)
+
+    def _lookup(self, priority, name, *args, **kwargs):
+        """Calls the lookup of the JSON client if it is used,
+        otherwise or when it fails the one of musicbrainzngs.
+        """
+        if self.json_client is not None:
+            try:
+                return self._request(options.lookup_server, priority, name,
+                                     getattr(self.json_client, name),
+                                     *args, **kwargs)
+            except musicbrainzngs.ResponseError:
+                raise
+            except EnvironmentError as err:
+                if server_error(err) is None:
+                    # network errors only affect this lookup
+                    logger.warning("JSON lookup failed, using XML for it: %s",
+                                   err)
+                else:
+                    # already retried, XML would fail the same way
+                    raise musicbrainzngs.NetworkError(cause=err)
+            except (ValueError, KeyError) as err:
+                # the response wasn't understood, JSON isn't used again
+                logger.warning("JSON lookup failed, using XML: %s", err)
+                self.json_client = None
+        function = self._on_server(options.lookup_server,
+                                   getattr(musicbrainzngs, name))
+        return self._request(options.lookup_server, priority, name, function,
+                             *args, **kwargs)
+
+    def _cached(self, key):
+        if self.cache is None:
+            return None
+        else:
+            return self.cache.get(key)
+
+    def get_releases_by_discid(self, disc_id, includes=[],
+                               priority=PRIORITY_INTERACTIVE):
+        if self.index is not None:
+            releases = self.index.releases_by_discid(disc_id)
+            if releases is not None:
+                return releases
+        key = ReleaseCache.key("discid", disc_id, includes,
+                               options.ws_format)
+        releases = self._cached(key)
+        if releases is not None:
+            return releases
+        try:
+            response = self._lookup(priority, "get_releases_by_discid",
+                                    disc_id, includes=includes)
+        except musicbrainzngs.ResponseError as err:
+            if err.cause.code == 404:
+                releases = []
+            else:
+                print_error("Couldn't fetch release: %s" % err)
+                sys.exit(1)
+        except musicbrainzngs.WebServiceError as err:
+            print_error("Couldn't fetch release: %s" % err)
+            sys.exit(1)
+        else:
+            if response.get("disc"):
+                # CD stubs have no releases
+                releases = response["disc"].get("release-list", [])
+            else:
+                releases = []
+        if self.cache is not None:
+            release_ids = [release["id"] for release in releases
+                           if release.get("id")]
+            self.cache.put(key, releases, release_ids, negative=not releases)
+        return releases
+
+    def get_release_by_id(self, release_id, includes=[],
+                          priority=PRIORITY_INTERACTIVE):
+        if self.index is not None:
+            release = self.index.release(release_id)
+            if release is not None:
+                return {"release": release}
+        key = ReleaseCache.key("release", release_id, includes,
+                               options.ws_format)
+        result = self._cached(key)
+        if result is not None:
+            return result
         try:
-            return musicbrainzngs.get_release_by_id(release_id,
-                                                    includes=includes)
-        except WebServiceError as err:
+            result = self._lookup(priority, "get_release_by_id",
+                                  release_id, includes=includes)
+        except musicbrainzngs.WebServiceError as err:
             print_error("Couldn't fetch release: %s" % err)
             sys.exit(1)
+        if self.cache is not None:
+            self.cache.put(key, result, [release_id])
+        return result
 
-    def submit_isrcs(self, tracks2isrcs):
+    def get_recordings_by_isrc(self, isrc, includes=[],
+                               priority=PRIORITY_INTERACTIVE):
+        """Returns the recordings with the ISRC
+
+        Other errors than a missing ISRC are raised as WebServiceError.
+        """
+        key = ReleaseCache.key("isrc", isrc, includes,
+                               options.ws_format)
+        recordings = self._cached(key)
+        if recordings is not None:
+            return recordings
+        try:
+            response = self._lookup(priority, "get_recordings_by_isrc",
+                                    isrc, includes=includes)
+        except musicbrainzngs.ResponseError as err:
+            if err.cause.code == 404:
+                # the ISRC isn't attached to any recording
+                recordings = []
+            else:
+                raise
+        else:
+            recordings = response["isrc"].get("recording-list", [])
+        if self.cache is not None:
+            release_ids = set()
+            for recording in recordings:
+                for release in recording.get("release-list", []):
+                    release_ids.add(release["id"])
+            self.cache.put(key, recordings, release_ids,
+                           negative=not recordings)
+        return recordings
+
+    def submit_isrcs(self, tracks2isrcs, release_ids=()):
+        """Submits the ISRCs and invalidates the cached releases
+        the tracks are on.
+
+        The ISRCs are sent in chunks of --chunk-size recordings.
+        A rejected chunk doesn't stop the others from being sent.
+        Returns the IDs of the recordings that were submitted.
+        """
         logger.info("tracks2isrcs: %s", tracks2isrcs)
+        track_ids = sorted(tracks2isrcs)
+        submitted = set()
+        for start in range(0, len(track_ids), options.chunk_size):
+            chunk = dict([(track_id, tracks2isrcs[track_id]) for track_id
+                          in track_ids[start:start + options.chunk_size]])
+            if self._submit_chunk(chunk):
+                submitted.update(chunk)
+        if len(submitted) == len(tracks2isrcs):
+            print("Successfully submitted %d ISRCS." % len(submitted))
+        else:
+            print_error("Only %d of %d ISRCs were submitted."
+                        % (len(submitted), len(tracks2isrcs)))
+        if submitted:
+            self.invalidate(release_ids)
+        return submitted
+
+    def confirmed_isrcs(self, release_id, tracks2isrcs, track_count):
+        """Returns the part of tracks2isrcs that is attached on the server
+
+        The recordings are looked up one by one or browsed on the release
+        with the track count given, whatever needs fewer requests.
+        Lookups on a mirror could be outdated, so the server is used.
+        """
+        pages = (track_count + BROWSE_LIMIT - 1) // BROWSE_LIMIT
+        recordings = []
+        try:
+            if len(tracks2isrcs) <= pages:
+                for recording_id in sorted(tracks2isrcs):
+                    result = self._request(
+                            options.server, PRIORITY_INTERACTIVE,
+                            "get_recording_by_id",
+                            self._on_server(options.server,
+                                    musicbrainzngs.get_recording_by_id),
+                            recording_id, includes=["isrcs"])
+                    recordings.append(result["recording"])
+            else:
+                offset = 0
+                while offset < track_count:
+                    result = self._request(
+                            options.server, PRIORITY_INTERACTIVE,
+                            "browse_recordings",
+                            self._on_server(options.server,
+                                    musicbrainzngs.browse_recordings),
+                            release=release_id, includes=["isrcs"],
+                            limit=BROWSE_LIMIT, offset=offset)
+                    recordings.extend(result["recording-list"])
+                    offset += BROWSE_LIMIT
+                    if offset >= int(result.get("recording-count", 0)):
+                        break
+        except musicbrainzngs.WebServiceError as err:
+            logger.warning("Couldn't verify ISRCs: %s", err)
+        confirmed = {}
+        for recording in recordings:
+            isrc = tracks2isrcs.get(recording["id"])
+            if isrc in recording.get("isrc-list", []):
+                confirmed[recording["id"]] = isrc
+        return confirmed
+
+    def add_confirmed_isrcs(self, release_id, confirmed):
+        """Adds the confirmed ISRCs to the cached lookups with the release
+
+        The cached lookups of these ISRCs are removed.
+        """
+        def patch_lookup(data):
+            if isinstance(data, dict):
+                # a release lookup, otherwise the releases of a disc ID
+                data = [data["release"]]
+            for release in data:
+                add_isrcs_to_release(release, confirmed)
+        if self.index is not None:
+            self.index.patch(release_id, lambda release:
+                             add_isrcs_to_release(release, confirmed))
+        if self.cache is not None:
+            self.cache.patch(release_id, patch_lookup, ["discid", "release"])
+            for isrc in set(confirmed.values()):
+                self.cache.forget("isrc", isrc)
+
+    def invalidate(self, release_ids):
+        """Makes sure the releases are looked up on the server again
+        """
+        for release_id in release_ids:
+            if self.index is not None:
+                self.index.remove(release_id)
+            if self.cache is not None:
+                self.cache.invalidate(release_id)
+
+    def forget_disc(self, disc_id):
+        """Removes the cached lookups of the disc ID,
+        which is about to be submitted or attached.
+        """
+        if self.cache is not None:
+            self.cache.forget("discid", disc_id)
+
+    def _submit_chunk(self, tracks2isrcs):
+        """Sends one submission request, returns False if it failed
+
+        Network errors are retried with an exponential backoff,
+        server errors were already retried for the request.
+        """
+        attempt = 0
         while True:
             try:
                 self.authenticate()
-                musicbrainzngs.submit_isrcs(tracks2isrcs)
-            except AuthenticationError as err:
+                self._request(options.server, PRIORITY_INTERACTIVE,
+                              "submit_isrcs", self._on_server(options.server,
+                                              musicbrainzngs.submit_isrcs),
+                              tracks2isrcs)
+            except musicbrainzngs.AuthenticationError as err:
                 print_error("Invalid credentials: %s" % err)
                 self.auth = False
                 self.keyring_failed = True
                 self.username = None
                 continue
-            except WebServiceError as err:
+            except musicbrainzngs.NetworkError as err:
+                if server_error(err) is not None or attempt >= SUBMIT_RETRIES:
+                    print_error("Couldn't send ISRCs: %s" % err)
+                    return False
+                delay = SUBMIT_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+                attempt += 1
+                logger.warning("Couldn't send ISRCs, retrying in %.1f s: %s",
+                               delay, err)
+                self.rate_limiter.pause(delay)
+            except musicbrainzngs.WebServiceError as err:
                 print_error("Couldn't send ISRCs: %s" % err)
-                sys.exit(1)
+                return False
             else:
-                print("Successfully submitted %d ISRCS." % len(tracks2isrcs))
-                break
-
+                return True
 
 
 class Disc(object):
     def read_disc(self):
+        if self._extraction is not None:
+            # don't access the drive while the backend is still reading
+            self._extraction.join()
         try:
             # calculate disc ID from disc
             if self._backend == "libdiscid" and not options.force_submit:
-                disc = discid.read(self._device, features=["mcn", "isrc"])
+                disc = read_discid(self._device, features=["mcn", "isrc"])
             else:
-                disc = discid.read(self._device)
+                disc = read_discid(self._device)
             self._disc = disc
-        except DiscError as err:
+        except discid.DiscError as err:
             print_error("DiscID calculation failed: %s" % err)
             sys.exit(1)
 
+    common_includes = ["artists", "labels", "recordings", "isrcs",
+                       "artist-credits"] # the last one only for cleanup
+    brief_includes = ["recordings", "isrcs"]
+    # enough for print_release, used for the choice with --prefetch
+    choice_includes = ["artists", "labels"]
+
     def __init__(self, device, backend, verified=False):
         if sys.platform == "darwin":
             self._device = get_real_mac_device(device)
@@ -668,8 +2182,9 @@ class Disc(object):
         self._backend = backend
         self._verified = verified
         self._asked_for_submission = False
-        self._common_includes=["artists", "labels", "recordings", "isrcs",
-                               "artist-credits"] # the last one only for cleanup
+        self._extraction = None
+        self._backend_output = None
+        self._prefetched = {}   # release ID -> BackgroundTask
         self.read_disc()        # sets self._disc
 
     @property
@@ -695,6 +2210,18 @@ class Disc(object):
         url = url.replace("//mm.", "//")
         return url.replace("musicbrainz.org", options.server)
 
+    @property
+    def backend_output(self):
+        """The (track, isrc) tuples found by the backend
+
+        This waits for the extraction started with extract_isrcs().
+        """
+        if self._backend_output is None:
+            output = self._extraction.result()
+            self._backend_output = list(
+                    get_backend(self._backend).parse(output))
+        return self._backend_output
+
     @property
     def asked_for_submission(self):
         return self._asked_for_submission
@@ -710,33 +2237,95 @@ class Disc(object):
             # can still be None
         return self._release
 
+    @release.setter
+    def release(self, release):
+        self._release = release
+
+    def extract_isrcs(self, device):
+        """Starts gathering the ISRCs with the backend in a separate thread.
+
+        This way the slow extraction happens while the release is fetched
+        and chosen.
+        """
+        self._extraction = Extraction(self, self._backend, device)
+        self._extraction.start()
+
+    @classmethod
+    def release_includes(cls):
+        """The includes of the release lookups
+
+        Artists and labels are not looked up with --brief.
+        """
+        if options.brief:
+            return cls.brief_includes
+        else:
+            return cls.common_includes
+
     def fetch_release(self, release_id):
         """Check if a pre-selected release has the correct TOC attached
         """
-        includes = self._common_includes + ["discids"]
-        result = ws2.get_release_by_id(release_id, includes=includes)
-        release = result["release"]
-        for medium in release["medium-list"]:
-            for disc in medium["disc-list"]:
-                if disc["id"] == self.id:
-                    return release
+        release = self.fetch_details(release_id)
+        if has_disc_id(release, self.id):
+            return release
         # disc ID is not attached to the release
         return None
 
+    def fetch_details(self, release_id, priority=PRIORITY_INTERACTIVE):
+        """Fetches the release with everything the ISRC checks need
+        """
+        includes = self.release_includes() + ["discids"]
+        result = ws2.get_release_by_id(release_id, includes=includes,
+                                       priority=priority)
+        return CompactRelease(result["release"])
+
+    def prefetch_details(self, releases):
+        """Starts fetching the details of the releases in the background.
+        """
+        for release in releases:
+            task = BackgroundTask(self.fetch_details,
+                                  (release["id"], PRIORITY_PREFETCH),
+                                  name=release["id"])
+            task.start()
+            self._prefetched[release["id"]] = task
+
+    def details(self, release):
+        """Returns the release with the details from the second lookup,
+        using the prefetched one if available.
+        """
+        task = self._prefetched.get(release["id"])
+        if task is None:
+            return self.fetch_details(release["id"])
+        else:
+            return task.result()
+
     def select_release(self):
         """Find the corresponding MusicBrainz release by disc ID
 
         This will ask the user to choose if the discID is ambiguous.
+        With --prefetch the releases to choose from are looked up without
+        the recordings first.  The details of the first candidates are
+        fetched while the user chooses.
         """
-        includes = self._common_includes
-        results = ws2.get_releases_by_discid(self.id, includes=includes)
+        if options.prefetch:
+            if options.brief:
+                includes = []
+            else:
+                includes = self.choice_includes
+        else:
+            includes = self.release_includes()
+        results = [CompactRelease(release) for release
+                   in ws2.get_releases_by_discid(self.id, includes=includes)]
         num_results = len(results)
+        if options.prefetch and num_results > 1 and not options.force_submit:
+            self.prefetch_details(results[:options.prefetch])
         if options.force_submit:
             print("\nSubmission forced.")
             selected_release = None
         elif num_results == 0:
             print("\nThis Disc ID is not in the database.")
             selected_release = None
+        elif num_results > 1 and options.auto_select is not None:
+            selected_release = self.auto_select(results)
         elif num_results > 1:
             print("\nThis Disc ID is ambiguous:")
             print(" 0: none of these\n")
@@ -751,7 +2340,8 @@ class Disc(object):
                 if int(num) not in range(0, num_results + 1):
                     raise IndexError
                 if int(num) == 0:
-                    ask_for_submission(self.submission_url, print_url=True)
+                    ask_for_submission(self.submission_url, self.id,
+                                       print_url=True)
                     sys.exit(1)
                 else:
                     selected_release = results[int(num) - 1]
@@ -764,15 +2354,45 @@ class Disc(object):
         else:
             selected_release = results[0]
 
+        if options.prefetch and selected_release and selected_release["id"]:
+            selected_release = self.details(selected_release)
         return selected_release
 
 
+    def auto_select(self, releases):
+        """Chooses the release matching the disc best without asking
+
+        The disc is queued for review when no release is good enough.
+        With --prefetch the releases are scored with their details,
+        the recordings are needed to compare the track lengths.
+        """
+        if options.prefetch:
+            self.prefetch_details([release for release in releases
+                                   if release["id"] not in self._prefetched])
+            releases = [self.details(release) for release in releases]
+        ranked = rank_releases(self, releases)
+        best_score, best = ranked[0]
+        confident = best_score >= options.auto_select
+        if len(ranked) > 1 and ranked[1][0] == best_score:
+            # a tie can't be decided
+            confident = False
+        if confident:
+            print("\nThis Disc ID is ambiguous, chose %s (score %.2f)"
+                  % (best["id"], best_score))
+            return best
+        queue_for_review(self, ranked)
+        print("\nThis Disc ID is ambiguous, queued for review in %s"
+              % options.review)
+        sys.exit(1)
+
     def get_release(self, verified=False):
         """This will get a release the ISRCs will be added to.
         """
 
         # check if a release was pre-selected
-        if options.release_id:
+        if self.id in manifest:
+            chosen_release = manifest[self.id]
+        elif options.release_id:
             chosen_release = self.fetch_release(options.release_id)
         else:
             chosen_release = self.select_release()
@@ -789,7 +2409,7 @@ class Disc(object):
         if chosen_release is None or options.force_submit:
             if verified:
                 url = self.submission_url
-                ask_for_submission(url, print_url=True)
+                ask_for_submission(url, self.id, print_url=True)
                 sys.exit(1)
             else:
                 print("recalculating to re-check..")
@@ -800,142 +2420,565 @@ class Disc(object):
         return chosen_release
 
 
-def get_disc(device, backend, verified=False):
-    """This creates a Disc object, which also calculates the id of the disc
+def has_disc_id(release, disc_id):
+    """Checks if the disc ID is attached to the release
     """
-    disc = Disc(device, backend, verified)
+    for medium in release["medium-list"]:
+        for disc in medium.get("disc-list", []):
+            if disc["id"] == disc_id:
+                return True
+    return False
+
+def score_release(disc, release):
+    """Returns how well the release matches the disc, from 0 to 1
+
+    The MCN of the disc is compared to the barcode
+    and the TOC track lengths to those on the matching medium.
+    """
+    scores = []
+    barcode = release.get("barcode")
+    if disc.mcn and barcode:
+        # a UPC is an EAN starting with 0
+        scores.append(float(barcode.zfill(13) == disc.mcn.zfill(13)))
+    toc_lengths = [getattr(track, "sectors", None) for track in disc.tracks]
+    if None not in toc_lengths:
+        for medium in release.get("medium-list", []):
+            if not has_disc_id({"medium-list": [medium]}, disc.id):
+                continue
+            lengths = [track.get("length")
+                       for track in medium.get("track-list", [])]
+            if lengths and None not in lengths:
+                matching = 0
+                if len(lengths) == len(toc_lengths):
+                    for sectors, length in zip(toc_lengths, lengths):
+                        # there are 75 sectors per second
+                        difference = abs(sectors * 1000 // 75 - int(length))
+                        if difference < LENGTH_TOLERANCE:
+                            matching += 1
+                scores.append(float(matching) / len(toc_lengths))
+            break
+    if not scores:
+        return 0.0
+    return sum(scores) / len(scores)
+
+def rank_releases(disc, releases):
+    """Returns (score, release) tuples, the best matching release first
+    """
+    ranked = [(score_release(disc, release), release)
+              for release in releases]
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return ranked
+
+def queue_for_review(disc, ranked):
+    """Appends the disc and the ranked releases to the review queue
+
+    The queue can be used as a manifest after the correct line
+    is uncommented.
+    """
+    with codecs.open(options.review, "a", "utf-8") as review:
+        review.write("# %s %s, %d releases\n"
+                     % (time.strftime("%Y-%m-%d %H:%M"), disc.id,
+                        len(ranked)))
+        for score, release in ranked:
+            line = "#%s %s  # %.2f %s - %s %s\n" % (
+                    disc.id, release["id"], score,
+                    release.get("artist-credit-phrase", ""),
+                    release.get("title", ""), release.get("barcode") or "")
+            review.write(line)
+
+def read_manifest(path):
+    """Returns the (disc ID, release ID) tuples listed in the file
+
+    Empty lines and everything after # are ignored.
+    """
+    entries = []
+    try:
+        with open(path, "r") as manifest_file:
+            for number, line in enumerate(manifest_file, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if len(fields) != 2:
+                    print_error("Invalid line %d in %s:" % (number, path),
+                                line)
+                    sys.exit(1)
+                entries.append((fields[0], fields[1]))
+    except IOError as err:
+        print_error("Couldn't read the manifest: %s" % err)
+        sys.exit(1)
+    return entries
+
+def fetch_manifest(path):
+    """Fetches the releases listed in the manifest
+
+    The web service can only look up one release per request, but every
+    release is only fetched once, even if several discs belong to it.
+    Returns a dict mapping the disc IDs to their release.
+    Entries with a release the disc ID is not attached to are left out.
+    """
+    entries = read_manifest(path)
+    releases = {}
+    for disc_id, release_id in entries:
+        if release_id in releases:
+            continue
+        try:
+            result = ws2.get_release_by_id(
+                    release_id, includes=Disc.release_includes() + ["discids"],
+                    priority=PRIORITY_PREFETCH)
+            releases[release_id] = CompactRelease(result["release"])
+        except SystemExit:
+            # the reason was already printed
+            releases[release_id] = None
+
+    found = {}
+    mismatches = []
+    for disc_id, release_id in entries:
+        release = releases[release_id]
+        if release is not None and has_disc_id(release, disc_id):
+            found[disc_id] = release
+        else:
+            mismatches.append((disc_id, release_id))
+    print("Fetched %d releases for %d discs from the manifest."
+          % (len([release for release in releases.values() if release]),
+             len(found)))
+    for disc_id, release_id in mismatches:
+        print_error("Disc ID %s is not attached to release %s"
+                    % (disc_id, release_id))
+    return found
+
+
+class BackgroundTask(threading.Thread):
+    """Runs a function in a separate thread.
+
+    The result (or exception) is handed over when result() is called.
+    When a queue is given, the finished task puts itself into it.
+    """
+
+    def __init__(self, function, args=(), name=None, queue=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self._function = function
+        self._args = args
+        self._queue = queue
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = self._function(*self._args)
+        except BaseException as err:
+            # includes SystemExit, used after errors are printed
+            self._error = err
+        if self._queue is not None:
+            self._queue.put(self)
+
+    def result(self):
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class HeldLogRecords(logging.Filter):
+    """Holds back the log records of a thread until they are released.
+    """
+
+    def __init__(self, thread_name):
+        logging.Filter.__init__(self)
+        self.thread_name = thread_name
+        self.records = []
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(self)
+
+    def filter(self, record):
+        if record.threadName == self.thread_name:
+            self.records.append(record)
+            return False
+        return True
+
+    def drop(self):
+        for handler in logging.getLogger().handlers:
+            handler.removeFilter(self)
+        records, self.records = self.records, []
+        return records
+
+    def release(self):
+        for record in self.drop():
+            logging.getLogger(record.name).handle(record)
+
+class Extraction(BackgroundTask):
+    """Gathers the output of the backend for a disc in a separate thread.
+
+    The messages of the backend are held back until the output is used,
+    so they don't show up while the user chooses the release.
+    """
+
+    def __init__(self, disc, backend, device):
+        BackgroundTask.__init__(self, collect_output, (disc, backend, device),
+                                name="extraction of %s" % device)
+        self.held = HeldLogRecords(self.name)
+
+    def start(self):
+        extractions.append(self)
+        BackgroundTask.start(self)
+
+    def result(self):
+        try:
+            return BackgroundTask.result(self)
+        finally:
+            self.held.release()
+
+# tasks running a backend and the programs they started
+extractions = []
+backend_processes = []
+
+def start_program(args, **kwargs):
+    """Starts a program for a backend,
+    it is terminated when isrcsubmit exits before it is finished.
+    """
+    proc = Popen(args, **kwargs)
+    backend_processes.append(proc)
+    return proc
+
+def stop_extractions():
+    """Stops the backends that are still reading a disc.
+
+    Their programs are terminated and their threads are waited for,
+    so temporary files are removed.
+    """
+    for proc in backend_processes:
+        if proc.poll() is None:
+            proc.terminate()
+    for task in extractions:
+        task.join()
+        if isinstance(task, Extraction):
+            # the messages are about the terminated programs
+            task.held.drop()
+    del backend_processes[:]
+    del extractions[:]
+
+
+def print_disc(disc):
     print('\nDiscID:\t\t%s' % disc.id)
     if disc.mcn:
         print('MCN/EAN:\t%s' % disc.mcn)
     print('Tracks on disc:\t%d' % len(disc.tracks))
+
+def get_disc(device, backend, verified=False):
+    """This creates a Disc object, which also calculates the id of the disc
+    """
+    disc = Disc(device, backend, verified)
+    print_disc(disc)
     return disc
 
+def get_mb_tracks(disc):
+    """Returns the tracks of the medium on the release matching the disc
+    """
+    media = []
+    for medium in disc.release["medium-list"]:
+        for disc_entry in medium["disc-list"]:
+            if disc_entry["id"] == disc.id:
+                media.append(medium)
+                break
+    if len(media) > 1:
+        raise discid.DiscError("number of discs with id: %d" % len(media))
+    return media[0]["track-list"]
+
+def read_drive(device, backend):
+    """Reads the disc ID and the ISRCs of the disc in one drive.
 
-def gather_isrcs(disc, backend, device):
-    """read the disc in the device with the backend and extract the ISRCs
+    This is run for every drive at the same time
+    and doesn't need any user interaction.
     """
-    backend_output = []
-    devnull = open(os.devnull, "w")
+    disc = Disc(device, backend)
+    backend_output = gather_isrcs(disc, backend, device)
+    return disc, backend_output
 
-    if backend == "libdiscid":
-        pattern = r'[A-Z]{2}[A-Z0-9]{3}\d{2}\d{5}'
-        for track in disc.tracks:
-            if track.isrc:
-                match = re.match(pattern, track.isrc)
-                if match is None:
-                    print("no valid ISRC: %s" % track.isrc)
-                else:
-                    backend_output.append((track.number, track.isrc))
 
-    # redundant to "libdiscid", but this might be handy for prerelease testing
-    elif backend == "discisrc":
-        pattern = \
-            r'Track\s+([0-9]+)\s+:\s+([A-Z]{2})-?([A-Z0-9]{3})-?(\d{2})-?(\d{5})'
-        try:
-            if sys.platform == "darwin":
-                device = get_real_mac_device(device)
-            proc = Popen([backend, device], stdout=PIPE)
-            isrcout = proc.stdout
-        except OSError as err:
-            backend_error(err)
-        for line in isrcout:
-            line = decode(line) # explicitely decode from pipe
-            ext_logger = logging.getLogger("discisrc")
-            ext_logger.debug(line.rstrip())    # rstrip newline
-            if line.startswith("Track") and len(line) > 12:
-                match = re.search(pattern, line)
-                if match is None:
-                    print("can't find ISRC in: %s" % line)
-                    continue
-                track_number = int(match.group(1))
-                isrc = ("%s%s%s%s" % (match.group(2), match.group(3),
-                                      match.group(4), match.group(5)))
-                backend_output.append((track_number, isrc))
-
-    # media_info is a preview version of mediatools, both are for Windows
-    # this does some kind of raw read
-    elif backend in ["mediatools", "media_info"]:
-        pattern = \
-            r'ISRC\s+([0-9]+)\s+([A-Z]{2})-?([A-Z0-9]{3})-?(\d{2})-?(\d{5})'
-        if backend == "mediatools":
-            args = [backend, "drive", device, "isrc"]
+def private_tempdir(prefix):
+    """Creates a temporary directory only we can access.
+
+    A directory in memory is used if available, which is only the case
+    on Linux (/dev/shm). Other systems get a directory on disk.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return tempfile.mkdtemp(prefix=prefix, dir="/dev/shm")
+    else:
+        return tempfile.mkdtemp(prefix=prefix)
+
+# ISRCs as given by libdiscid and in toc files
+ISRC_PATTERN = re.compile(r'[A-Z]{2}[A-Z0-9]{3}\d{2}\d{5}')
+
+backend_registry = {}
+
+def register_backend(backend_class):
+    """Makes a Backend subclass available by its name.
+
+    New backends have the lowest priority when searching for a backend.
+    """
+    backend_registry[backend_class.name] = backend_class()
+    if backend_class.name not in BACKENDS:
+        BACKENDS.append(backend_class.name)
+    return backend_class
+
+def get_backend(name):
+    return backend_registry[name]
+
+
+class Backend(object):
+    """A library or program that extracts ISRCs from a disc.
+
+    output() gives the raw output of the backend for a disc,
+    which is parsed item by item with parse().
+    """
+
+    name = None
+    # what can be read from a disc: "toc", "mcn", "isrc" and "cd-text"
+    capabilities = frozenset()
+    # rough estimate of the seconds needed for a full disc
+    cost = 0
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.name)
+
+    def available(self, strict=False):
+        return has_program(self.name, strict)
+
+    def version(self):
+        return self.name
+
+    def output(self, disc, device):
+        raise NotImplementedError
+
+    def parse(self, output):
+        """Yields (track, isrc) tuples
+        """
+        raise NotImplementedError
+
+    def dump_item(self, item):
+        """Returns the output item as it is stored in a cassette
+        """
+        return item
+
+    def load_item(self, item):
+        return item
+
+    def collect(self, disc, device):
+        """read the disc in the device and return the whole output
+        """
+        if cassette is None:
+            output = self.output(disc, device)
         else:
-            args = [backend, device]
+            output = cassette.stream("backend", "%s %s" % (self.name, device),
+                                     lambda: self.output(disc, device),
+                                     dump=self.dump_item, load=self.load_item)
+        return list(output)
+
+    def read(self, disc, device):
+        """read the disc in the device and extract the ISRCs
+        """
+        return list(self.parse(self.collect(disc, device)))
+
+
+class PipeBackend(Backend):
+    """A program that prints the ISRCs to stdout.
+
+    The lines are parsed while the program is still running.
+    """
+
+    # the line prefix and a pattern matching the track and ISRC parts
+    prefix = None
+    pattern = None
+
+    def args(self, device):
+        raise NotImplementedError
+
+    def output(self, disc, device):
         try:
-            proc = Popen(args, stdout=PIPE)
-            isrcout = proc.stdout
+            proc = start_program(self.args(device), stdout=PIPE)
         except OSError as err:
             backend_error(err)
-        for line in isrcout:
-            line = decode(line) # explicitely decode from pipe
-            ext_logger = logging.getLogger("mediatools")
-            ext_logger.debug(line.rstrip())    # rstrip newline
-            if line.startswith("ISRC") and not line.startswith("ISRCS"):
-                match = re.search(pattern, line)
+        for line in proc.stdout:
+            yield decode(line) # explicitely decode from pipe
+        proc.wait()
+
+    def accept(self, line):
+        return line.startswith(self.prefix)
+
+    def parse(self, output):
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        for line in output:
+            if debug:
+                self.logger.debug(line.rstrip())    # rstrip newline
+            if self.accept(line):
+                match = self.pattern.search(line)
                 if match is None:
                     print("can't find ISRC in: %s" % line)
                     continue
                 track_number = int(match.group(1))
                 isrc = ("%s%s%s%s" % (match.group(2), match.group(3),
                                       match.group(4), match.group(5)))
-                backend_output.append((track_number, isrc))
-
-    # cdrdao will create a temp file and we delete it afterwards
-    # cdrdao is also available for windows
-    # this will also fetch ISRCs from CD-TEXT
-    elif backend == "cdrdao":
-        # no byte pattern, file is opened as unicode
-        pattern = r'[A-Z]{2}[A-Z0-9]{3}\d{2}\d{5}'
-        tmpname = "cdrdao-%s.toc" % datetime.now()
-        tmpname = tmpname.replace(":", "-")     # : is invalid on windows
-        tmpfile = os.path.join(tempfile.gettempdir(), tmpname)
-        logger.info("Saving toc in %s..", tmpfile)
-        if os.name == "nt":
-            if device != discid.get_default_device():
-                logger.warning("cdrdao uses the default device")
-            args = [backend, "read-toc", "--fast-toc", "-v", "0", tmpfile]
-        else:
-            args = [backend, "read-toc", "--fast-toc", "--device", device,
-                "-v", "0", tmpfile]
+                yield (track_number, isrc)
+
+
+@register_backend
+class MediatoolsBackend(PipeBackend):
+    """mediatools does some kind of raw read (Windows)"""
+
+    name = "mediatools"
+    capabilities = frozenset(["isrc"])
+    cost = 60
+    prefix = "ISRC"
+    pattern = re.compile(
+        r'ISRC\s+([0-9]+)\s+([A-Z]{2})-?([A-Z0-9]{3})-?(\d{2})-?(\d{5})')
+
+    def args(self, device):
+        return [self.name, "drive", device, "isrc"]
+
+    def accept(self, line):
+        return line.startswith(self.prefix) and not line.startswith("ISRCS")
+
+
+@register_backend
+class MediaInfoBackend(MediatoolsBackend):
+    """media_info is a preview version of mediatools"""
+
+    name = "media_info"
+
+    def args(self, device):
+        return [self.name, device]
+
+
+@register_backend
+class CdrdaoBackend(Backend):
+    """cdrdao writes a toc file, which is deleted afterwards.
+
+    cdrdao is also available for windows.
+    This will also fetch ISRCs from CD-TEXT.
+    """
+
+    name = "cdrdao"
+    capabilities = frozenset(["toc", "mcn", "isrc", "cd-text"])
+    cost = 20
+
+    def version(self):
+        outdata = Popen([self.name], stderr=PIPE).communicate()[1]
+        return b" ".join(outdata.splitlines()[0].split()[::2][0:2])
+
+    def output(self, disc, device):
+        # cdrdao refuses to write to existing files, including pipes
+        tmpdir = private_tempdir("cdrdao-")
         try:
-            if options.debug:
-                proc = Popen(args, stdout=devnull)
+            tocfile = os.path.join(tmpdir, "disc.toc")
+            logger.info("Saving toc in %s..", tocfile)
+            if os.name == "nt":
+                if device != discid.get_default_device():
+                    logger.warning("cdrdao uses the default device")
+                args = [self.name, "read-toc", "--fast-toc", "-v", "0",
+                        tocfile]
             else:
-                proc = Popen(args, stdout=devnull, stderr=devnull)
-            if proc.wait() != 0:
-                print_error("%s returned with %i" % (backend, proc.returncode))
-                sys.exit(1)
-        except OSError as err:
-            backend_error(err)
-        else:
+                args = [self.name, "read-toc", "--fast-toc",
+                        "--device", device, "-v", "0", tocfile]
+            try:
+                with open(os.devnull, "w") as devnull:
+                    if options.debug:
+                        proc = start_program(args, stdout=devnull)
+                    else:
+                        proc = start_program(args, stdout=devnull,
+                                             stderr=devnull)
+                    if proc.wait() != 0:
+                        print_error("%s returned with %i"
+                                    % (self.name, proc.returncode))
+                        sys.exit(1)
+            except OSError as err:
+                backend_error(err)
             # that file seems to be opened in Unicode mode in Python 3
-            with open(tmpfile, "r") as toc:
-                track_number = None
+            with open(tocfile, "r") as toc:
                 for line in toc:
-                    ext_logger = logging.getLogger("cdrdao")
-                    ext_logger.debug(line.rstrip())    # rstrip newline
-                    words = line.split()
-                    if words:
-                        if words[0] == "//":
-                            track_number = int(words[2])
-                        elif words[0] == "ISRC" and track_number is not None:
-                            isrc = "".join(words[1:]).strip('"- ')
-                            match = re.match(pattern, isrc)
-                            if match is None:
-                                print("no valid ISRC: %s" % isrc)
-                            else:
-                                backend_output.append((track_number, isrc))
-                                # safeguard against missing trackNumber lines
-                                # or duplicated ISRC tags (like in CD-Text)
-                                track_number = None
+                    yield line
         finally:
-            try:
-                os.unlink(tmpfile)
-            except OSError:
-                pass
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def parse(self, output):
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        track_number = None
+        for line in output:
+            if debug:
+                self.logger.debug(line.rstrip())    # rstrip newline
+            words = line.split()
+            if words:
+                if words[0] == "//":
+                    track_number = int(words[2])
+                elif words[0] == "ISRC" and track_number is not None:
+                    isrc = "".join(words[1:]).strip('"- ')
+                    if ISRC_PATTERN.match(isrc) is None:
+                        print("no valid ISRC: %s" % isrc)
+                    else:
+                        yield (track_number, isrc)
+                        # safeguard against missing trackNumber lines
+                        # or duplicated ISRC tags (like in CD-Text)
+                        track_number = None
+
+
+@register_backend
+class LibdiscidBackend(Backend):
+    """libdiscid reads the ISRCs together with the disc ID"""
 
-    devnull.close()
-    return backend_output
+    name = "libdiscid"
+    capabilities = frozenset(["toc", "mcn", "isrc"])
+    cost = 10
+
+    def version(self):
+        return discid.LIBDISCID_VERSION_STRING
+
+    def output(self, disc, device):
+        return disc.tracks
+
+    def dump_item(self, track):
+        return {"number": track.number, "isrc": track.isrc}
+
+    def load_item(self, item):
+        return Replayed(item)
+
+    def parse(self, output):
+        for track in output:
+            if track.isrc:
+                if ISRC_PATTERN.match(track.isrc) is None:
+                    print("no valid ISRC: %s" % track.isrc)
+                else:
+                    yield (track.number, track.isrc)
+
+
+@register_backend
+class DiscisrcBackend(PipeBackend):
+    """redundant to libdiscid, but this might be handy for prerelease testing
+    """
+
+    name = "discisrc"
+    capabilities = frozenset(["isrc"])
+    cost = 10
+    prefix = "Track"
+    pattern = re.compile(r'Track\s+([0-9]+)\s+:\s+'
+                         r'([A-Z]{2})-?([A-Z0-9]{3})-?(\d{2})-?(\d{5})')
+
+    def args(self, device):
+        if sys.platform == "darwin":
+            device = get_real_mac_device(device)
+        return [self.name, device]
+
+    def accept(self, line):
+        return line.startswith(self.prefix) and len(line) > 12
+
+
+def gather_isrcs(disc, backend, device):
+    """read the disc in the device with the backend and extract the ISRCs
+    """
+    return get_backend(backend).read(disc, device)
+
+def collect_output(disc, backend, device):
+    """read the disc in the device with the backend, without parsing
+    """
+    return get_backend(backend).collect(disc, device)
 
 def check_isrcs_local(backend_output, mb_tracks):
     """check backend_output for (local) duplicates and inconsistencies
@@ -944,13 +2987,17 @@ def check_isrcs_local(backend_output, mb_tracks):
     tracks2isrcs = dict()   # isrcs to be submitted
     errors = 0
 
+    # the track numbers every ISRC was found for
+    isrc_tracks = dict()
+    for (track_number, isrc) in backend_output:
+        isrc_tracks.setdefault(isrc, []).append(track_number)
+
     for (track_number, isrc) in backend_output:
         if isrc not in isrcs:
             isrcs[isrc] = Isrc(isrc)
             # check if we found this ISRC for multiple tracks
-            with_isrc = [item for item in backend_output if item[1] == isrc]
-            if len(with_isrc) > 1:
-                track_list = [str(item[0]) for item in with_isrc]
+            if len(isrc_tracks[isrc]) > 1:
+                track_list = [str(number) for number in isrc_tracks[isrc]]
                 print_error("%s gave the same ISRC for multiple tracks!"
                             % options.backend,
                             "ISRC: %s\ttracks: %s"
@@ -978,9 +3025,11 @@ def check_isrcs_local(backend_output, mb_tracks):
 
     return isrcs, tracks2isrcs, errors
 
-def check_global_duplicates(release, mb_tracks, isrcs):
+def check_global_duplicates(release, mb_tracks, isrcs, disc_id=None):
     """Help cleaning up global duplicates with the information we got
     from our disc.
+
+    With --report the duplicates are written to the report instead.
     """
     duplicates = 0
     # add already attached ISRCs
@@ -992,18 +3041,65 @@ def check_global_duplicates(release, mb_tracks, isrcs):
             # only check ISRCS we also found on our disc
             if isrc in isrcs:
                 isrcs[isrc].add_track(track)
+    # recordings with these ISRCs on discs we processed earlier
+    for isrc in isrcs:
+        for recording in open_isrc_index().recordings(isrc):
+            isrcs[isrc].add_track(ForeignTrack(recording))
+    looked_up = None
+    if options.check_isrcs:
+        # recordings on other releases, ours are already added
+        looked_up = lookup_isrcs(list(isrcs))
+        for isrc, recordings in looked_up.items():
+            for recording in recordings:
+                isrcs[isrc].add_track(ForeignTrack(recording))
     # check if we have multiple tracks for one ISRC
     for isrc in isrcs:
         if len(isrcs[isrc].get_tracks()) > 1:
             duplicates += 1
 
-    if duplicates > 0:
+    if report is not None:
+        # entries from an earlier check of the disc are replaced
+        report.add(release, disc_id, isrcs, looked_up)
+        report.write()
+        if duplicates > 0:
+            print("\nThere were %d ISRCs that are attached to multiple"
+                  " tracks, they are listed in %s"
+                  % (duplicates, report.path))
+    elif duplicates > 0:
         printf("\nThere were %d ISRCs ", duplicates)
         print("that are attached to multiple tracks on this release.")
         choice = user_input("Do you want to help clean those up? [y/N] ")
         if choice.lower() == "y":
             cleanup_isrcs(release, isrcs)
 
+def lookup_isrcs(isrc_ids):
+    """Looks up the recordings of every ISRC
+
+    Several lookups run at the same time, within the rate limit.
+    Returns a dict mapping the ISRCs to their recordings,
+    ISRCs that couldn't be looked up are left out.
+    """
+    includes = ["releases", "artist-credits"]
+    def lookup_chunk(chunk):
+        found = []
+        for isrc in chunk:
+            try:
+                found.append((isrc, ws2.get_recordings_by_isrc(
+                        isrc, includes=includes)))
+            except musicbrainzngs.WebServiceError as err:
+                logger.warning("Couldn't look up ISRC %s: %s", isrc, err)
+        return found
+
+    tasks = []
+    for i in range(min(ISRC_WORKERS, len(isrc_ids))):
+        task = BackgroundTask(lookup_chunk, (isrc_ids[i::ISRC_WORKERS],))
+        task.start()
+        tasks.append(task)
+    recordings = {}
+    for task in tasks:
+        recordings.update(task.result())
+    return recordings
+
 def cleanup_isrcs(release, isrcs):
     """Show information about duplicate ISRCs
 
@@ -1016,10 +3112,12 @@ def cleanup_isrcs(release, isrcs):
             for track in tracks:
                 printf("\t")
                 artist = track.get("artist-credit-phrase")
-                if artist and artist != release["artist-credit-phrase"]:
-                    string = "%s - %s" % (artist, track["title"])
+                # recordings in the ISRC index have no title
+                title = track.get("title") or track["id"]
+                if artist and artist != release.get("artist-credit-phrase"):
+                    string = "%s - %s" % (artist, title)
                 else:
-                    string = "%s" % track["title"]
+                    string = "%s" % title
                 print_encoded(string)
                 # tab alignment
                 if len(string) >= 32:
@@ -1034,6 +3132,9 @@ def cleanup_isrcs(release, isrcs):
                     if len(string) < 31:
                         printf("\t")
 
+                if isinstance(track, ForeignTrack):
+                    print_encoded("\t on %s\n" % track.releases)
+                    continue
                 printf("\t track %s", track["position"])
                 if isinstance(track, OwnTrack):
                     print("   [OUR EVALUATION]")
@@ -1046,18 +3147,434 @@ def cleanup_isrcs(release, isrcs):
                 user_input("(press <return> when done with this ISRC) ")
 
 
+class DuplicateReport(object):
+    """Collects the duplicate ISRCs of the discs for a later cleanup.
+
+    The report is written as JSON or, if the file name ends with .html,
+    as an HTML page with the JSON data embedded.
+    Entries of an existing report are kept, so one report can be used
+    for a batch of runs.
+    """
+
+    data_start = '<script type="application/json" id="report">'
+    data_end = "</script>"
+
+    def __init__(self, path):
+        self.path = path
+        self.html = path.lower().endswith((".html", ".htm"))
+        self.entries = []
+        if os.path.isfile(path):
+            self.entries = self.load()["duplicates"]
+
+    def load(self):
+        with codecs.open(self.path, "r", "utf-8") as report_file:
+            content = report_file.read()
+        if self.html:
+            start = content.index(self.data_start) + len(self.data_start)
+            content = content[start:content.index(self.data_end, start)]
+        return json.loads(content)
+
+    def add(self, release, disc_id, isrcs, looked_up=None):
+        """Adds the ISRCs attached to several tracks
+
+        The recordings are looked up to show where they are used,
+        unless the result of lookup_isrcs is given as looked_up.
+        """
+        duplicates = [isrc for isrc in sorted(isrcs)
+                      if len(isrcs[isrc].get_tracks()) > 1]
+        if looked_up is None:
+            looked_up = lookup_isrcs(duplicates)
+        # a disc checked again replaces the entries from before
+        self.entries = [entry for entry in self.entries
+                        if entry["disc_id"] != disc_id]
+        for isrc in duplicates:
+            found = dict([(recording["id"], recording)
+                          for recording in looked_up.get(isrc, [])])
+            recordings = []
+            for track in isrcs[isrc].get_tracks():
+                recording = found.get(track["id"], {})
+                if isinstance(track, ForeignTrack):
+                    position = None
+                else:
+                    position = track["position"]
+                recordings.append({
+                    "id": track["id"],
+                    "title": recording.get("title", track.get("title")),
+                    "artist": recording.get("artist-credit-phrase",
+                                            track.get("artist-credit-phrase")),
+                    "position": position,
+                    "ours": isinstance(track, OwnTrack),
+                    "releases": [{"id": entry["id"],
+                                  "title": entry.get("title")}
+                                 for entry in recording.get("release-list",
+                                                            [])]})
+            self.entries.append({
+                "isrc": isrc, "disc_id": disc_id,
+                "url": "http://%s/isrc/%s" % (options.server, isrc),
+                "release": {"id": release["id"], "title": release["title"],
+                            "artist": release.get("artist-credit-phrase")},
+                "recordings": recordings})
+
+    def to_html(self, data):
+        def escape(text):
+            return (("%s" % text).replace("&", "&amp;").replace("<", "&lt;")
+                    .replace(">", "&gt;").replace('"', "&quot;"))
+        def link(entity, entity_id, text):
+            return '<a href="http://%s/%s/%s">%s</a>' % (
+                    escape(options.server), entity, escape(entity_id),
+                    escape(text or entity_id))
+
+        lines = ["<!DOCTYPE html>", "<html>", "<head>",
+                 '<meta charset="utf-8">',
+                 "<title>Duplicate ISRCs</title>", "</head>", "<body>",
+                 "<h1>Duplicate ISRCs</h1>",
+                 "<p>%d ISRCs, written %s</p>" % (len(self.entries),
+                                                  escape(data["written"]))]
+        for entry in self.entries:
+            release = entry["release"]
+            lines.append('<h2><a href="%s">%s</a></h2>'
+                         % (escape(entry["url"]), escape(entry["isrc"])))
+            lines.append("<p>Found on disc %s of %s</p>"
+                         % (escape(entry["disc_id"]),
+                            link("release", release["id"], release["title"])))
+            lines.append("<table>")
+            lines.append("<tr><th>Recording</th><th>Artist</th>"
+                         "<th>Track</th><th>Releases</th></tr>")
+            for recording in entry["recordings"]:
+                releases = ", ".join([link("release", item["id"],
+                                           item["title"])
+                                      for item in recording["releases"]])
+                track = escape(recording["position"] or "")
+                if recording["ours"]:
+                    track += " [OUR EVALUATION]"
+                lines.append("<tr><td>%s</td><td>%s</td><td>%s</td>"
+                             "<td>%s</td></tr>"
+                             % (link("recording", recording["id"],
+                                     recording["title"]),
+                                escape(recording["artist"] or ""),
+                                track, releases))
+            lines.append("</table>")
+        # the data is kept to add the duplicates of later runs
+        lines.append(self.data_start
+                     + json.dumps(data).replace("</", "<\\/")
+                     + self.data_end)
+        lines.extend(["</body>", "</html>", ""])
+        return "\n".join(lines)
+
+    def write(self):
+        data = {"written": time.strftime("%Y-%m-%d %H:%M"),
+                "duplicates": self.entries}
+        if self.html:
+            content = self.to_html(data)
+        else:
+            content = json.dumps(data, indent=2, sort_keys=True)
+        with codecs.open(self.path, "w", "utf-8") as report_file:
+            report_file.write(content)
+
+
+def show_release(disc):
+    print("")
+    print_release(disc.release)
+    if not disc.asked_for_submission:
+        print("")
+        print("Is this information different for your release?")
+        ask_for_submission(disc.submission_url, disc.id)
+
+def submit_new_isrcs(submissions, errors):
+    """Asks the user and submits the new ISRCs of all discs together.
+
+    The submissions are (disc, tracks2isrcs) tuples.
+    With --journal the ISRCs are only recorded for a later submission.
+    Returns False when the user decided against the submission.
+    """
+    tracks2isrcs = dict()
+    for disc, disc_tracks2isrcs in submissions:
+        for track_id, isrc in disc_tracks2isrcs.items():
+            if tracks2isrcs.get(track_id, isrc) != isrc:
+                print_error("Different ISRCs found for the same track!",
+                            "ISRCs: %s, %s" % (tracks2isrcs[track_id], isrc))
+                errors += 1
+            else:
+                tracks2isrcs[track_id] = isrc
+
+    if not tracks2isrcs:
+        print("No new ISRCs could be found.")
+        return True
+    if errors > 0:
+        print_error("%d problems detected" % errors)
+    if options.journal:
+        question = "Do you want to record the ISRCs for submission? [y/N] "
+    else:
+        question = "Do you want to submit? [y/N] "
+    if user_input(question).lower() != "y":
+        print("Nothing was submitted to the server.")
+        return False
+    elif options.journal:
+        journal = Journal()
+        for disc, disc_tracks2isrcs in submissions:
+            journal.record(disc_tracks2isrcs, disc.id, disc.release["id"])
+        print("Recorded %d ISRCs in the journal." % len(tracks2isrcs))
+        print("Submit them later with --flush-journal.")
+        return True
+    else:
+        release_ids = [disc.release["id"]
+                       for disc, disc_tracks2isrcs in submissions]
+        if options.verify:
+            # the cached releases are updated by the verification
+            submitted = ws2.submit_isrcs(tracks2isrcs)
+        else:
+            submitted = ws2.submit_isrcs(tracks2isrcs, release_ids)
+        if len(submitted) < len(tracks2isrcs):
+            # the reason was already printed
+            if options.verify and submitted:
+                ws2.invalidate(release_ids)
+            sys.exit(1)
+        if options.verify:
+            verify_submission(submissions)
+        return True
+
+def add_isrcs_to_release(release, confirmed):
+    """Adds the confirmed ISRCs to the recordings on the release
+
+    This works for the releases of the web service
+    and for compact releases.
+    """
+    for medium in release.get("medium-list", []):
+        for track in medium.get("track-list", []):
+            recording = track.get("recording")
+            if recording is None:
+                continue
+            isrc = confirmed.get(recording["id"])
+            isrc_list = recording.get("isrc-list", [])
+            if isrc is not None and isrc not in isrc_list:
+                recording["isrc-list"] = isrc_list + [isrc]
+
+def verify_submission(submissions):
+    """Checks that the submitted ISRCs are attached to the recordings now.
+
+    The server is polled with a growing delay until all are confirmed.
+    The confirmed ISRCs are added to the releases in memory
+    and in the cache, the releases with unconfirmed ISRCs are refetched
+    the next time.
+    """
+    pending = {}            # release ID -> (release, tracks2isrcs)
+    for disc, tracks2isrcs in submissions:
+        if tracks2isrcs:
+            release, release_tracks2isrcs = pending.setdefault(
+                    disc.release["id"], (disc.release, {}))
+            release_tracks2isrcs.update(tracks2isrcs)
+    total = sum([len(tracks2isrcs) for release, tracks2isrcs
+                 in pending.values()])
+    print("Verifying the submitted ISRCs..")
+    for attempt in range(VERIFY_ATTEMPTS):
+        if attempt:
+            time.sleep(VERIFY_DELAY * 2 ** (attempt - 1))
+        for release_id in sorted(pending):
+            release, tracks2isrcs = pending[release_id]
+            track_count = sum([len(medium.get("track-list", []))
+                               for medium in release["medium-list"]])
+            confirmed = ws2.confirmed_isrcs(release_id, tracks2isrcs,
+                                            track_count)
+            if confirmed:
+                add_isrcs_to_release(release, confirmed)
+                ws2.add_confirmed_isrcs(release_id, confirmed)
+                for recording_id in confirmed:
+                    del tracks2isrcs[recording_id]
+            if not tracks2isrcs:
+                del pending[release_id]
+        if not pending:
+            break
+    missing = sum([len(tracks2isrcs) for release, tracks2isrcs
+                   in pending.values()])
+    if missing:
+        ws2.invalidate(pending)
+        print_error("%d of %d ISRCs aren't attached yet." % (missing, total))
+    else:
+        print("All %d ISRCs are attached." % total)
+
+def open_isrc_index():
+    """Returns the ISRC index, which is only opened once per run
+    """
+    global isrc_index
+    if isrc_index is None:
+        isrc_index = IsrcIndex()
+    return isrc_index
+
+def remember_isrcs(disc, isrcs):
+    """Adds the ISRCs found on the disc to the ISRC index
+    """
+    open_isrc_index().record(isrcs, disc.id, disc.release["id"],
+                             options.backend)
+
+def query_isrc(isrc):
+    """Prints where the ISRC was seen before
+    """
+    isrc = isrc.replace("-", "").upper()
+    seen = open_isrc_index().lookup(isrc)
+    if not seen:
+        print("ISRC %s wasn't seen on any disc yet." % isrc)
+        return
+    recording_ids = set([entry[0] for entry in seen])
+    print("ISRC %s was seen for %d recordings:" % (isrc, len(recording_ids)))
+    last_recording = None
+    for recording_id, release_id, disc_id, backend, seen_time in seen:
+        if recording_id != last_recording:
+            print("\nRecording:\t%s" % recording_id)
+            last_recording = recording_id
+        print("\tRelease %s, disc ID %s" % (release_id, disc_id))
+        print("\t\tfound with %s on %s"
+              % (backend, time.strftime("%Y-%m-%d %H:%M",
+                                        time.localtime(seen_time))))
+    if len(recording_ids) > 1:
+        print("\nThe ISRC is attached to several recordings!")
+
+def flush_journal():
+    """Submits the ISRCs recorded in the journal.
+
+    Many discs are submitted with one request, but a recording can only
+    be in a request once.
+    """
+    journal = Journal()
+    entries = journal.pending()
+    if not entries:
+        print("There are no ISRCs left in the journal.")
+        return
+    print("Submitting %d ISRCs from the journal.." % len(entries))
+
+    # (tracks2isrcs, [(entry_id, track_id)], release_ids) for every request
+    requests = []
+    for entry_id, track_id, isrc, release_id in entries:
+        for tracks2isrcs, entry_ids, release_ids in requests:
+            if tracks2isrcs.get(track_id, isrc) == isrc:
+                break
+        else:
+            tracks2isrcs, entry_ids, release_ids = dict(), [], set()
+            requests.append((tracks2isrcs, entry_ids, release_ids))
+        tracks2isrcs[track_id] = isrc
+        entry_ids.append((entry_id, track_id))
+        release_ids.add(release_id)
+
+    failed = 0
+    for tracks2isrcs, entry_ids, release_ids in requests:
+        submitted = ws2.submit_isrcs(tracks2isrcs, release_ids)
+        # the ISRCs of rejected chunks stay in the journal
+        journal.mark_submitted([entry_id for entry_id, track_id in entry_ids
+                                if track_id in submitted])
+        failed += len(tracks2isrcs) - len(submitted)
+    if failed:
+        print_error("%d ISRCs are left in the journal." % failed)
+        sys.exit(1)
+
+def process_drive(device):
+    """Handles the disc in one drive.
+
+    The ISRCs are extracted while the release is chosen.
+    """
+    disc = get_disc(device, options.backend)
+    disc.extract_isrcs(device)
+    disc.get_release()
+    show_release(disc)
+    mb_tracks = get_mb_tracks(disc)
+
+    print("")
+    # (track, isrc)
+    backend_output = disc.backend_output
+    # list, dict
+    isrcs, tracks2isrcs, errors = check_isrcs_local(backend_output, mb_tracks)
+
+    if isrcs:
+        print("")
+    # try to submit the ISRCs
+    update_intention = submit_new_isrcs([(disc, tracks2isrcs)], errors)
+
+    # check for overall duplicate ISRCs, including server provided
+    if update_intention:
+        # the ISRCs are deemed correct, so we can use them to check others
+        remember_isrcs(disc, isrcs)
+        check_global_duplicates(disc.release, mb_tracks, isrcs, disc.id)
+
+def process_drives(devices):
+    """Handles the discs in several drives.
+
+    All drives are read at the same time, while the releases are chosen
+    one disc after the other.  Releases are only looked up once per disc ID
+    and the ISRCs of all discs are submitted together.
+    """
+    finished = Queue()
+    for device in devices:
+        task = BackgroundTask(read_drive, (device, options.backend),
+                              name=device, queue=finished)
+        extractions.append(task)
+        task.start()
+
+    releases = {}           # disc ID -> release, shared between drives
+    submissions = []        # (disc, tracks2isrcs) for every disc
+    checked = []            # (disc, mb_tracks, isrcs) for every disc
+    errors = 0
+    for i in range(len(devices)):
+        task = finished.get()
+        print("\nDevice:\t\t%s" % task.name)
+        try:
+            disc, backend_output = task.result()
+            print_disc(disc)
+            if disc.id in releases:
+                disc.release = releases[disc.id]
+                print("")
+                print_release(disc.release)
+            else:
+                disc.get_release()
+                releases[disc.id] = disc.release
+                show_release(disc)
+            mb_tracks = get_mb_tracks(disc)
+        except discid.DiscError as err:
+            print_error("Couldn't match the disc in %s: %s"
+                        % (task.name, err),
+                        "Skipping the disc in %s" % task.name)
+            continue
+        except SystemExit:
+            # the reason was already printed
+            print_error("Skipping the disc in %s" % task.name)
+            continue
+
+        print("")
+        isrcs, tracks2isrcs, disc_errors = check_isrcs_local(backend_output,
+                                                             mb_tracks)
+        errors += disc_errors
+        submissions.append((disc, tracks2isrcs))
+        checked.append((disc, mb_tracks, isrcs))
+
+    print("")
+    if submit_new_isrcs(submissions, errors):
+        for disc, mb_tracks, isrcs in checked:
+            remember_isrcs(disc, isrcs)
+            check_global_duplicates(disc.release, mb_tracks, isrcs, disc.id)
+
+
 def main(argv):
     global options
     global ws2
+    global cassette
+    global manifest
+    global report
+    global isrc_index
 
     # preset logger
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
     logging.getLogger().addHandler(stream_handler) # add to root handler
 
+    # Windows consoles can use the unicode codepage
+    codecs.register(cp65001)
+
     # global variables
     options = gather_options(argv)
+    cassette = None
+    if options.record:
+        cassette = Cassette(options.record)
+    elif options.replay:
+        cassette = Cassette(options.replay, replay=True)
     ws2 = WebService2(options.user)
+    isrc_index = None
 
     if options.debug:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -1077,52 +3594,35 @@ def main(argv):
         logger.debug(script_version())
 
     logger.info("using discid version %s", discid.__version__)
-    print("using %s" % get_prog_version(options.backend))
-
-    disc = get_disc(options.device, options.backend)
-    disc.get_release()
-    print("")
-    print_release(disc.release)
-    if not disc.asked_for_submission:
-        print("")
-        print("Is this information different for your release?")
-        ask_for_submission(disc.submission_url)
+    if options.flush_journal:
+        flush_journal()
+        return
+    if options.query_isrc:
+        query_isrc(options.query_isrc)
+        return
+    if options.import_dump:
+        count = OfflineIndex().import_dump(options.import_dump,
+                                           options.server)
+        print("Imported %d releases." % count)
+        return
 
-    media = []
-    for medium in disc.release["medium-list"]:
-        for disc_entry in medium["disc-list"]:
-            if disc_entry["id"] == disc.id:
-                media.append(medium)
-                break
-    if len(media) > 1:
-        raise DiscError("number of discs with id: %d" % len(media))
-    mb_tracks = media[0]["track-list"]
+    print("using %s" % get_prog_version(options.backend))
 
-    print("")
-    # (track, isrc)
-    backend_output = gather_isrcs(disc, options.backend, options.device)
-    # list, dict
-    isrcs, tracks2isrcs, errors = check_isrcs_local(backend_output, mb_tracks)
+    report = None
+    if options.report:
+        report = DuplicateReport(options.report)
+    manifest = {}
+    if options.manifest:
+        manifest = fetch_manifest(options.manifest)
 
-    if isrcs:
-        print("")
-    # try to submit the ISRCs
-    update_intention = True
-    if not tracks2isrcs:
-        print("No new ISRCs could be found.")
-    else:
-        if errors > 0:
-            print_error("%d problems detected" % errors)
-        if user_input("Do you want to submit? [y/N] ").lower() == "y":
-            ws2.submit_isrcs(tracks2isrcs)
+    try:
+        if len(options.devices) > 1:
+            process_drives(options.devices)
         else:
-            update_intention = False
-            print("Nothing was submitted to the server.")
-
-    # check for overall duplicate ISRCs, including server provided
-    if update_intention:
-        # the ISRCs are deemed correct, so we can use them to check others
-        check_global_duplicates(disc.release, mb_tracks, isrcs)
+            process_drive(options.devices[0])
+    finally:
+        # after errors and Ctrl-C the backends can still be running
+        stop_extractions()
 
 if __name__ == "__main__":
     main(sys.argv)
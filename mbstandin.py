@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# Copyright (C) 2015  Johannes Dewender
+# This stand-in is free. You can redistribute and/or modify it at will.
+"""A stand-in for the MusicBrainz web service
+
+The web service lookups are answered with the data in test_data/
+in the XML or the JSON format and ISRC submissions are accepted,
+so isrcsubmit can be run against a local server with --server.
+Latency, server errors and a rate limit can be added for load tests.
+The server counts connections, requests and bytes sent, which is used
+by the benchmarks and the tests.
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import threading
+from io import BytesIO
+from optparse import OptionParser
+from xml.etree.ElementTree import Element, SubElement, tostring, fromstring
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "test_data")
+NAMESPACE = "http://musicbrainz.org/ns/mmd-2.0#"
+# keys musicbrainzngs adds while parsing, they are not part of the XML
+DERIVED = ["artist-credit-phrase", "track_or_recording_length"]
+ATTRIBUTES = ["id", "type"]
+# the names of the lists in the JSON format
+JSON_LISTS = {"release-list": "releases", "medium-list": "media",
+              "disc-list": "discs", "track-list": "tracks",
+              "isrc-list": "isrcs", "label-info-list": "label-info",
+              "offset-list": "offsets", "recording-list": "recordings"}
+JSON_NUMBERS = ["position", "length", "sectors"]
+
+
+def _artist_credit(parent, credits):
+    element = SubElement(parent, "artist-credit")
+    name_credit = None
+    for credit in credits:
+        if isinstance(credit, dict):
+            name_credit = SubElement(element, "name-credit")
+            if "name" in credit:
+                SubElement(name_credit, "name").text = credit["name"]
+            _element(name_credit, "artist", credit["artist"])
+        else:
+            # join phrases follow the credit they belong to
+            name_credit.set("joinphrase", credit)
+
+def _element(parent, tag, data, count=None):
+    if tag == "artist-credit":
+        _artist_credit(parent, data)
+    elif tag.endswith("-list"):
+        # browsed lists are only a page of all the entities counted
+        element = SubElement(parent, tag, count=count or str(len(data)))
+        for item in data:
+            if tag == "isrc-list":
+                SubElement(element, "isrc", id=item)
+            else:
+                _element(element, tag[:-len("-list")], item)
+    elif isinstance(data, dict):
+        element = SubElement(parent, tag)
+        for key in sorted(data):
+            if key in DERIVED or key.endswith("-count"):
+                continue
+            elif key in ATTRIBUTES:
+                element.set(key, data[key])
+            else:
+                _element(element, key, data[key])
+    else:
+        SubElement(parent, tag).text = data
+
+def to_xml(data):
+    """Converts a result of musicbrainzngs back to a ws/2 XML document
+    """
+    root = Element("metadata", xmlns=NAMESPACE)
+    for key in data:
+        if key.endswith("-list"):
+            _element(root, key, data[key],
+                     data.get(key[:-len("list")] + "count"))
+        elif not key.endswith("-count"):
+            _element(root, key, data[key])
+    return tostring(root, encoding="UTF-8")
+
+
+def _json_artist_credit(credits):
+    result = []
+    for credit in credits:
+        if isinstance(credit, dict):
+            result.append({"name": credit.get("name",
+                                              credit["artist"]["name"]),
+                           "joinphrase": "",
+                           "artist": _json_entity(credit["artist"])})
+        else:
+            result[-1]["joinphrase"] = credit
+    return result
+
+def _json_entity(data):
+    result = {}
+    for key, value in data.items():
+        if key in DERIVED or key.endswith("-count"):
+            continue
+        elif key == "artist-credit":
+            result[key] = _json_artist_credit(value)
+        elif key in JSON_LISTS:
+            result[JSON_LISTS[key]] = [_json_entity(item)
+                                       if isinstance(item, dict) else item
+                                       for item in value]
+        elif isinstance(value, dict):
+            result[key] = _json_entity(value)
+        elif key in JSON_NUMBERS:
+            result[key] = int(value)
+        else:
+            result[key] = value
+    return result
+
+def to_json(data):
+    """Converts a result of musicbrainzngs to a ws/2 JSON document
+    """
+    # the JSON documents have no root element
+    for key in data:
+        entity = _json_entity(data[key])
+        if key == "isrc":
+            entity["isrc"] = entity.pop("id")
+        return json.dumps(entity).encode("utf-8")
+
+
+class Fixtures(object):
+    """The web service data that is available in test_data/
+
+    Submitted ISRCs are added to the recordings.
+    """
+
+    def __init__(self, path=TEST_DATA, without_isrcs=False):
+        self.discs = {}
+        self.releases = {}
+        self.recordings = {}    # id -> the recording on every release
+        self.appearances = {}   # recording id -> the releases it is on
+        # disc ID lookups as sent by the server in the JSON format
+        self.json_discs = {}
+        for name in os.listdir(path):
+            if not name.endswith(".json"):
+                continue
+            if name.endswith("_ws2.json"):
+                with open(os.path.join(path, name), "rb") as data_file:
+                    self.json_discs[name[:-len("_ws2.json")]] = \
+                            data_file.read()
+                continue
+            with open(os.path.join(path, name), "r") as data_file:
+                data = json.load(data_file)
+            if name.endswith("_releases.json"):
+                self.discs[data["disc"]["id"]] = data
+                for release in data["disc"]["release-list"]:
+                    self.releases.setdefault(release["id"],
+                                             {"release": release})
+            elif "release" in data:
+                self.releases[data["release"]["id"]] = data
+        # most releases are found by disc ID and by ID
+        releases = dict((id(data["release"]), data["release"])
+                        for data in self.releases.values())
+        for data in self.discs.values():
+            for release in data["disc"]["release-list"]:
+                releases[id(release)] = release
+        for release in releases.values():
+            for medium in release.get("medium-list", []):
+                for track in medium.get("track-list", []):
+                    recording = track["recording"]
+                    if without_isrcs:
+                        recording["isrc-list"] = []
+                    self.recordings.setdefault(recording["id"],
+                                               []).append(recording)
+                    appearances = self.appearances.setdefault(
+                            recording["id"], {})
+                    appearances[release["id"]] = {"id": release["id"],
+                                                  "title": release["title"]}
+
+    def lookup(self, entity, entity_id):
+        """Returns the response data, None when it is not found
+        """
+        if entity == "discid":
+            return self.discs.get(entity_id)
+        elif entity == "release":
+            return self.releases.get(entity_id)
+        elif entity == "isrc":
+            return self.isrc(entity_id)
+        elif entity == "recording" and entity_id in self.recordings:
+            return {"recording": self.recordings[entity_id][0]}
+        else:
+            return None
+
+    def browse_recordings(self, release_id, offset=0, limit=25):
+        """Returns a page of the recordings on the release,
+        None when the release is unknown
+        """
+        if release_id not in self.releases:
+            return None
+        recordings = []
+        release = self.releases[release_id]["release"]
+        for medium in release.get("medium-list", []):
+            for track in medium.get("track-list", []):
+                recording = self.recordings[track["recording"]["id"]][0]
+                if recording not in recordings:
+                    recordings.append(recording)
+        return {"recording-list": recordings[offset:offset + limit],
+                "recording-count": str(len(recordings))}
+
+    def isrc(self, isrc):
+        """Returns the recordings with the ISRC, None when there are none
+        """
+        recordings = []
+        for recording_id in sorted(self.recordings):
+            recording = self.recordings[recording_id][0]
+            if isrc in recording.get("isrc-list", []):
+                recording = dict(recording)
+                releases = self.appearances[recording_id]
+                recording["release-list"] = [releases[release_id]
+                                             for release_id
+                                             in sorted(releases)]
+                recordings.append(recording)
+        if not recordings:
+            return None
+        return {"isrc": {"id": isrc, "recording-list": recordings}}
+
+    def add_isrcs(self, recording_id, isrcs):
+        """Adds the ISRCs to the recording,
+        returns False if the recording is unknown
+        """
+        if recording_id not in self.recordings:
+            return False
+        for recording in self.recordings[recording_id]:
+            isrc_list = recording.setdefault("isrc-list", [])
+            for isrc in isrcs:
+                if isrc not in isrc_list:
+                    isrc_list.append(isrc)
+        return True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, status, body, content_type="application/xml"):
+        self.server.count("requests")
+        self.server.count("bytes_uncompressed", len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", "%s; charset=UTF-8" % content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            compressed = BytesIO()
+            gzip_file = gzip.GzipFile(fileobj=compressed, mode="wb")
+            gzip_file.write(body)
+            gzip_file.close()
+            body = compressed.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count("bytes_sent", len(body))
+
+    def refuse(self):
+        """Answers with 503 for injected errors and the rate limit,
+        like the real server does when it is overloaded.
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.server.count("errors")
+        elif not self.server.allow(self.client_address[0]):
+            self.server.count("rate_limited")
+        else:
+            return False
+        self.send_body(503, to_xml({"error": {"text": "Service Unavailable"}}))
+        return True
+
+    def do_GET(self):
+        if self.refuse():
+            return
+        path, _, query = self.path.partition("?")
+        # browse requests can have a trailing slash
+        path = path.rstrip("/").split("/")
+        data = None
+        if len(path) == 5 and path[1:3] == ["ws", "2"]:
+            data = self.server.fixtures.lookup(path[3], path[4])
+        elif path == ["", "ws", "2", "recording"]:
+            # browse requests are only answered in the XML format
+            arguments = dict([argument.partition("=")[::2]
+                              for argument in query.split("&")])
+            data = self.server.fixtures.browse_recordings(
+                    arguments.get("release"),
+                    int(arguments.get("offset", 0)),
+                    int(arguments.get("limit", 25)))
+        if "fmt=json" in query.split("&"):
+            if (data is None and path[1:4] == ["ws", "2", "discid"]
+                    and path[4] in self.server.fixtures.json_discs):
+                # only available in the JSON format, like CD stubs
+                self.send_body(200, self.server.fixtures.json_discs[path[4]],
+                               "application/json")
+            elif data is None:
+                self.send_body(404, b'{"error": "Not Found"}',
+                               "application/json")
+            else:
+                self.send_body(200, to_json(data), "application/json")
+        elif data is None:
+            self.send_body(404, to_xml({"error": {"text": "Not Found"}}))
+        else:
+            self.send_body(200, to_xml(data))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.refuse():
+            return
+        if self.path.split("?")[0] != "/ws/2/recording":
+            self.send_body(404, to_xml({"error": {"text": "Not Found"}}))
+            return
+        ns = "{%s}" % NAMESPACE
+        submitted = []
+        for recording in fromstring(body).iter(ns + "recording"):
+            recording_id = recording.get(ns + "id", recording.get("id"))
+            isrcs = [isrc.get(ns + "id", isrc.get("id"))
+                     for isrc in recording.iter(ns + "isrc")]
+            if self.server.apply_submissions:
+                with self.server.lock:
+                    known = self.server.fixtures.add_isrcs(recording_id,
+                                                           isrcs)
+                if not known:
+                    self.send_body(400, to_xml({"error": {
+                            "text": "unknown recording %s" % recording_id}}))
+                    return
+            submitted.extend((recording_id, isrc) for isrc in isrcs)
+        with self.server.lock:
+            self.server.submissions.extend(submitted)
+        self.server.count("submitted_isrcs", len(submitted))
+        self.send_body(200, to_xml({"message": {"text": "OK"}}))
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """The stand-in server, port 0 picks a free port.
+
+    Every request is delayed by the latency in seconds. The error rate
+    is the fraction of requests answered with 503, the rate limit
+    the requests per second allowed for every client address.
+    Submitted ISRCs are only added to the releases when the submissions
+    are applied.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, verbose=False, latency=0, error_rate=0,
+                 rate_limit=None, without_isrcs=False,
+                 apply_submissions=True):
+        HTTPServer.__init__(self, ("localhost", port), StandInHandler)
+        self.verbose = verbose
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.apply_submissions = apply_submissions
+        self.fixtures = Fixtures(without_isrcs=without_isrcs)
+        self.lock = threading.Lock()
+        self._buckets = {}      # client -> (tokens, last update)
+        self.submissions = []   # (recording, isrc)
+        self.stats = {}
+        self.reset()
+
+    @property
+    def host(self):
+        """The value for --server
+        """
+        return "localhost:%d" % self.server_address[1]
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"connections": 0, "requests": 0,
+                          "bytes_sent": 0, "bytes_uncompressed": 0,
+                          "errors": 0, "rate_limited": 0,
+                          "submitted_isrcs": 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def allow(self, client):
+        """Takes a token from the bucket of the client,
+        returns False if there is none
+        """
+        if not self.rate_limit:
+            return True
+        # a second worth of requests can be sent at once
+        burst = max(1.0, self.rate_limit)
+        now = time.time()
+        with self.lock:
+            tokens, updated = self._buckets.get(client, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * self.rate_limit)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                return False
+            self._buckets[client] = (tokens - 1, now)
+            return True
+
+    def start(self):
+        """Serves requests in a background thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-p", "--port", type="int", default=8000,
+            help="Port to listen on. Default: 8000")
+    parser.add_option("--latency", type="float", default=0, metavar="SECONDS",
+            help="Delay every request by this time.")
+    parser.add_option("--error-rate", type="float", default=0,
+            metavar="FRACTION",
+            help="Fraction of the requests answered with 503.")
+    parser.add_option("--rate-limit", type="float", metavar="REQUESTS",
+            help="Requests per second allowed for every client.")
+    parser.add_option("--without-isrcs", action="store_true", default=False,
+            help="Remove the ISRCs from the releases, so they are submitted.")
+    parser.add_option("-q", "--quiet", action="store_true", default=False,
+            help="Don't log the requests.")
+    (options, args) = parser.parse_args(argv[1:])
+    server = StandIn(options.port, verbose=not options.quiet,
+                     latency=options.latency, error_rate=options.error_rate,
+                     rate_limit=options.rate_limit,
+                     without_isrcs=options.without_isrcs)
+    print("use --server %s" % server.host)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
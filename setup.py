@@ -79,6 +79,10 @@ class Test(Command):
                 self.names = []
         else:
             self.names = ["test_isrcsubmit.TestInternal",
+                          "test_isrcsubmit.TestCache",
+                          "test_isrcsubmit.TestTransport",
+                          "test_isrcsubmit.TestOfflineIndex",
+                          "test_isrcsubmit.TestJournal",
                           "test_isrcsubmit.TestScript"]
 
     def run(self):
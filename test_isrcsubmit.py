@@ -7,13 +7,19 @@ import re
 import sys
 import math
 import json
+import time
 import pickle
+import shutil
+import tarfile
+import tempfile
 import unittest
+import threading
 from io import TextIOWrapper, BytesIO
-from subprocess import Popen
+from subprocess import Popen, PIPE
 
 import musicbrainzngs
 import isrcsubmit
+import mbstandin
 
 
 try:
@@ -30,6 +36,9 @@ SAVE_RUN = False
 
 class TestInternal(unittest.TestCase):
     def setUp(self):
+        # don't use the configuration and databases of the user
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
         # suppress output
         with open(os.devnull, 'w') as devnull:
             self._old_stdout = os.dup(sys.stdout.fileno())
@@ -72,9 +81,843 @@ class TestInternal(unittest.TestCase):
         self.assertEqual(options.user, user)
         self.assertEqual(options.device, device)
 
+    def test_devices(self):
+        options = isrcsubmit.gather_options([SCRIPT_NAME, "-d", "/dev/sr1"])
+        self.assertEqual(options.devices, ["/dev/sr1"])
+        options = isrcsubmit.gather_options([SCRIPT_NAME,
+                                             "--devices", "/dev/sr0, /dev/sr1"])
+        self.assertEqual(options.devices, ["/dev/sr0", "/dev/sr1"])
+        options = isrcsubmit.gather_options([SCRIPT_NAME, "--all-drives"])
+        self.assertTrue(options.devices)
+
+    def test_find_programs(self):
+        old_path = os.environ["PATH"]
+        bin_dir = os.path.join(self._config_home, "bin")
+        os.mkdir(bin_dir)
+        browser = os.path.join(bin_dir, "xdg-open")
+        with open(browser, "w") as browser_file:
+            browser_file.write("#!/bin/sh\n")
+        os.chmod(browser, 0o755)
+        os.environ["PATH"] = bin_dir
+        try:
+            self.assertEqual(isrcsubmit.which("xdg-open"), browser)
+            self.assertTrue(isrcsubmit.which("firefox") is None)
+            self.assertEqual(isrcsubmit.find_programs(),
+                             ("cdrdao", "xdg-open"))
+            # the saved result is used
+            self.assertEqual(isrcsubmit.find_programs(),
+                             ("cdrdao", "xdg-open"))
+            os.remove(browser)
+            self.assertEqual(isrcsubmit.find_programs(), ("cdrdao", None))
+        finally:
+            os.environ["PATH"] = old_path
+
+    def test_lookup_isrcs_errors(self):
+        class WebService(object):
+            def get_recordings_by_isrc(self, isrc, includes=[]):
+                if isrc == "DEA120000002":
+                    raise musicbrainzngs.NetworkError("connection lost")
+                return [{"id": "recording-%s" % isrc}]
+        old_ws2 = isrcsubmit.ws2
+        isrcsubmit.ws2 = WebService()
+        try:
+            recordings = isrcsubmit.lookup_isrcs(["DEA120000001",
+                                                  "DEA120000002",
+                                                  "DEA120000003"])
+        finally:
+            isrcsubmit.ws2 = old_ws2
+        # the failed lookup doesn't stop the others
+        self.assertEqual(sorted(recordings), ["DEA120000001", "DEA120000003"])
+
+    def test_check_isrcs_local(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--backend", "libdiscid"])
+        # synthetic box set with 10000 tracks
+        count = 10000
+        mb_tracks = []
+        backend_output = []
+        for number in range(1, count + 1):
+            isrc = "DEA%02d%07d" % (number % 100, number)
+            recording = {"id": "recording-%d" % number, "isrc-list": []}
+            if number % 10 == 0:
+                recording["isrc-list"].append(isrc)
+            mb_tracks.append({"position": str(number), "recording": recording})
+            backend_output.append((number, isrc))
+        # the ISRC of the first track is also found for the second track
+        backend_output.append((2, backend_output[0][1]))
+
+        start = time.time()
+        isrcs, tracks2isrcs, errors = isrcsubmit.check_isrcs_local(
+                                                backend_output, mb_tracks)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(errors, 1)
+        self.assertEqual(len(isrcs), count)
+        self.assertEqual(len(tracks2isrcs), count - count // 10)
+        self.assertEqual(isrcs[backend_output[0][1]].get_track_numbers(),
+                         "1, 2")
+        self.assertEqual(len(isrcs[backend_output[1][1]].get_tracks()), 1)
+
+    def test_parse_cdrdao_toc(self):
+        file_name = "%s%s_cdrdao.toc" % (TEST_DATA,
+                                         "hSI7B4G4AkB5.DEBcW.3KCn.D_E-")
+        with open(file_name, "r") as toc:
+            backend = isrcsubmit.get_backend("cdrdao")
+            backend_output = list(backend.parse(toc))
+        self.assertEqual(len(backend_output), 19)
+        self.assertEqual(backend_output[0], (1, "GBBBN7902002"))
+        self.assertTrue((7, "GBBBN7902023") in backend_output)
+
+    def test_cdrdao_failure(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--backend", "cdrdao"])
+        tmpdirs = []
+        old_private_tempdir = isrcsubmit.private_tempdir
+        def private_tempdir(prefix):
+            tmpdirs.append(tempfile.mkdtemp(prefix=prefix))
+            return tmpdirs[-1]
+        # cdrdao fails to read the disc
+        isrcsubmit.private_tempdir = private_tempdir
+        isrcsubmit.Popen = lambda args, **kwargs: Popen(["false"])
+        try:
+            backend = isrcsubmit.get_backend("cdrdao")
+            self.assertRaises(SystemExit, list,
+                              backend.output(None, "/dev/cdrw"))
+        finally:
+            isrcsubmit.private_tempdir = old_private_tempdir
+            isrcsubmit.Popen = _Popen
+        self.assertEqual(len(tmpdirs), 1)
+        self.assertFalse(os.path.exists(tmpdirs[0]))
+
+    def test_backends(self):
+        for name in isrcsubmit.BACKENDS:
+            backend = isrcsubmit.get_backend(name)
+            self.assertEqual(backend.name, name)
+            self.assertTrue("isrc" in backend.capabilities)
+        output = ["Track  1 : DE-A12-15-00001\n", "Track  2 : none\n",
+                  "Track 10 : DEA121500010\n"]
+        backend_output = isrcsubmit.get_backend("discisrc").parse(output)
+        self.assertEqual(list(backend_output),
+                         [(1, "DEA121500001"), (10, "DEA121500010")])
+        output = ["ISRCS found: 2\n", "ISRC 01 DE-A12-15-00001\n",
+                  "ISRC 02 DEA121500002\n"]
+        backend_output = isrcsubmit.get_backend("mediatools").parse(output)
+        self.assertEqual(list(backend_output),
+                         [(1, "DEA121500001"), (2, "DEA121500002")])
+
+    def test_rate_limiter(self):
+        limiter = isrcsubmit.RateLimiter(rate=10)
+        self.assertTrue(limiter.acquire() < 0.05)
+        self.assertTrue(limiter.acquire() > 0.05)
+
+        # urgent requests are served first
+        served = []
+        def request(priority):
+            limiter.acquire(priority)
+            served.append(priority)
+        prefetch = threading.Thread(target=request,
+                                    args=(isrcsubmit.PRIORITY_PREFETCH,))
+        prefetch.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=request,
+                                       args=(isrcsubmit.PRIORITY_INTERACTIVE,))
+        interactive.start()
+        prefetch.join()
+        interactive.join()
+        self.assertEqual(served, [isrcsubmit.PRIORITY_INTERACTIVE,
+                                  isrcsubmit.PRIORITY_PREFETCH])
+
+    def test_lazy_imports(self):
+        # heavy modules are only imported when needed
+        script = ("import sys, isrcsubmit; print(' '.join(sorted(set(%r)"
+                  " & set(sys.modules))))"
+                  % ["discid", "musicbrainzngs", "keyring", "webbrowser",
+                     "sqlite3"])
+        proc = Popen([sys.executable, "-c", script], stdout=PIPE)
+        imported = proc.communicate()[0].decode().strip()
+        self.assertEqual(imported, "")
+
+    def test_background_task(self):
+        task = isrcsubmit.BackgroundTask(sorted, ([3, 1, 2],))
+        task.start()
+        self.assertEqual(task.result(), [1, 2, 3])
+        task = isrcsubmit.BackgroundTask(sys.exit, (1,))
+        task.start()
+        self.assertRaises(SystemExit, task.result)
+
+    def test_compact_release(self):
+        with open("%s%s_releases.json"
+                  % (TEST_DATA, "TqvKjMu7dMliSfmVEBtrL7sBSno-")) as data:
+            data = json.load(data)["disc"]["release-list"][0]
+        release = isrcsubmit.CompactRelease(data)
+        self.assertEqual(release["id"], data["id"])
+        self.assertEqual(release["artist-credit-phrase"],
+                         data["artist-credit-phrase"])
+        self.assertEqual(release.get("label-info-list")[0]["catalog-number"],
+                         data["label-info-list"][0]["catalog-number"])
+        # fields isrcsubmit doesn't use are dropped
+        self.assertFalse("asin" in release)
+        self.assertRaises(KeyError, lambda: release["asin"])
+        self.assertEqual(release.get("asin", "none"), "none")
+        self.assertRaises(AttributeError, setattr, release, "asin", "")
+
+        track = release["medium-list"][0]["track-list"][3]
+        own_track = isrcsubmit.OwnTrack(track, 4)
+        self.assertEqual(own_track["position"], "4")
+        self.assertEqual(own_track["id"], track["recording"]["id"])
+        self.assertTrue("DEC680000220" in own_track.get("isrc-list"))
+
+    def test_score_release(self):
+        # 100 and 200 seconds
+        disc = isrcsubmit.Replayed({"id": "disc-id", "mcn": "0123456789012"})
+        disc.tracks = [isrcsubmit.Replayed({"sectors": sectors})
+                       for sectors in [7500, 15000]]
+        medium = {"disc-list": [{"id": "disc-id"}],
+                  "track-list": [{"position": "1", "length": "100000"},
+                                 {"position": "2", "length": "200500"}]}
+        release = isrcsubmit.CompactRelease({"id": "upc",
+                                             "barcode": "123456789012",
+                                             "medium-list": [medium]})
+        self.assertEqual(isrcsubmit.score_release(disc, release), 1.0)
+        medium["track-list"][1]["length"] = "190000"
+        release = isrcsubmit.CompactRelease({"id": "other",
+                                             "barcode": "4012345678901",
+                                             "medium-list": [medium]})
+        self.assertEqual(isrcsubmit.score_release(disc, release), 0.25)
+        # no track lengths without the recordings
+        release = isrcsubmit.CompactRelease({"id": "other"})
+        self.assertEqual(isrcsubmit.score_release(disc, release), 0.0)
+
     def tearDown(self):
         # restore output
         os.dup2(self._old_stdout, 1)
+        shutil.rmtree(self._config_home)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
+
+    def test_lookup(self):
+        cache = isrcsubmit.ReleaseCache()
+        key = isrcsubmit.ReleaseCache.key("discid", "some-disc",
+                                          ["recordings", "isrcs"])
+        other_key = isrcsubmit.ReleaseCache.key("discid", "some-disc",
+                                                ["isrcs", "recordings"])
+        self.assertEqual(key, other_key)
+        self.assertTrue(cache.get(key) is None)
+        cache.put(key, [{"id": "release-1"}], ["release-1"])
+        self.assertEqual(cache.get(key), [{"id": "release-1"}])
+        # the cache is persistent
+        self.assertEqual(isrcsubmit.ReleaseCache().get(key),
+                         [{"id": "release-1"}])
+
+    def test_expiration(self):
+        cache = isrcsubmit.ReleaseCache(ttl=-1)
+        cache.put("release/expired", {}, ["expired"])
+        self.assertTrue(cache.get("release/expired") is None)
+        cache = isrcsubmit.ReleaseCache(negative_ttl=-1)
+        cache.put("discid/unknown", [], [], negative=True)
+        self.assertTrue(cache.get("discid/unknown") is None)
+        cache.put("discid/known", [{"id": "known"}], ["known"])
+        self.assertTrue(cache.get("discid/known"))
+
+    def test_eviction(self):
+        cache = isrcsubmit.ReleaseCache(size=2)
+        cache.put("release/1", {"id": "1"}, ["1"])
+        time.sleep(0.01)
+        cache.put("release/2", {"id": "2"}, ["2"])
+        time.sleep(0.01)
+        cache.get("release/1")
+        time.sleep(0.01)
+        cache.put("release/3", {"id": "3"}, ["3"])
+        self.assertTrue(cache.get("release/1"))
+        self.assertTrue(cache.get("release/2") is None)
+        self.assertTrue(cache.get("release/3"))
+
+    def test_invalidation(self):
+        cache = isrcsubmit.ReleaseCache()
+        cache.put("discid/disc", [{"id": "1"}, {"id": "12"}], ["1", "12"])
+        cache.put("release/1", {"id": "1"}, ["1"])
+        cache.put("release/12", {"id": "12"}, ["12"])
+        cache.invalidate("12")
+        self.assertTrue(cache.get("discid/disc") is None)
+        self.assertTrue(cache.get("release/1"))
+        self.assertTrue(cache.get("release/12") is None)
+
+    def test_patch(self):
+        cache = isrcsubmit.ReleaseCache()
+        cache.put("release/1?inc=", {"release": {"id": "1"}}, ["1"])
+        cache.put("isrc/DEA120000001?inc=", [{"id": "recording"}], ["1"])
+        def patch(data):
+            data["release"]["title"] = "patched"
+        cache.patch("1", patch, ["discid", "release"])
+        self.assertEqual(cache.get("release/1?inc="),
+                         {"release": {"id": "1", "title": "patched"}})
+        self.assertEqual(cache.get("isrc/DEA120000001?inc="),
+                         [{"id": "recording"}])
+
+    def test_servers(self):
+        name = isrcsubmit.ReleaseCache.file_name("test.musicbrainz.org")
+        self.assertNotEqual(name, isrcsubmit.ReleaseCache.file_name(
+                "musicbrainz.org"))
+        self.assertEqual(isrcsubmit.ReleaseCache.file_name("127.0.0.1:80"),
+                         "cache-127.0.0.1_80.db")
+        key = isrcsubmit.ReleaseCache.key("discid", "some-disc")
+        isrcsubmit.ReleaseCache(name).put(key, [{"id": "1"}], ["1"])
+        self.assertTrue(isrcsubmit.ReleaseCache().get(key) is None)
+        self.assertTrue(isrcsubmit.ReleaseCache(name).get(key))
+        # the formats don't share entries either
+        self.assertTrue(isrcsubmit.ReleaseCache(name).get(
+                isrcsubmit.ReleaseCache.key("discid", "some-disc",
+                                            ws_format="json")) is None)
+
+    def test_forget(self):
+        cache = isrcsubmit.ReleaseCache()
+        key = isrcsubmit.ReleaseCache.key("discid", "a_disc", ["recordings"])
+        cache.put(key, [], [], negative=True)
+        cache.put("discid/a_disc?inc=", [{"id": "1"}], ["1"])
+        cache.put("discid/aXdisc?inc=", [{"id": "2"}], ["2"])
+        cache.forget("discid", "a_disc")
+        self.assertTrue(cache.get(key) is None)
+        self.assertTrue(cache.get("discid/a_disc?inc=") is None)
+        self.assertTrue(cache.get("discid/aXdisc?inc="))
+
+    def tearDown(self):
+        shutil.rmtree(self._config_home)
+
+
+def without_counts(data):
+    """Removes the list lengths musicbrainzngs adds for the XML format
+    """
+    if isinstance(data, dict):
+        return dict((key, without_counts(value))
+                    for key, value in data.items()
+                    if not key.endswith("-count"))
+    elif isinstance(data, list):
+        return [without_counts(item) for item in data]
+    else:
+        return data
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
+        self.server = mbstandin.StandIn()
+        self.server.start()
+        self._handler = musicbrainzngs.compat.HTTPHandler
+        self.transport = isrcsubmit.Transport()
+        self.transport.install()
+        musicbrainzngs.set_hostname(self.server.host)
+        musicbrainzngs.set_useragent("isrcsubmit-test", "0.1")
+        musicbrainzngs.set_rate_limit(False)
+
+    def test_keep_alive(self):
+        disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        with open("%s%s_releases.json" % (TEST_DATA, disc_id)) as data:
+            expected = json.load(data)["disc"]["release-list"]
+        for i in range(3):
+            result = _mbngs_get_releases_by_discid(disc_id)
+            self.assertEqual([r["id"] for r in result["disc"]["release-list"]],
+                             [r["id"] for r in expected])
+        release = _mbngs_get_release_by_id(expected[0]["id"])
+        self.assertEqual(release["release"]["title"], expected[0]["title"])
+
+        self.assertEqual(self.server.stats["requests"], 4)
+        self.assertEqual(self.server.stats["connections"], 1)
+        self.assertEqual(self.transport.connections, 1)
+        # the responses were compressed on the wire
+        self.assertEqual(self.transport.bytes_received,
+                         self.server.stats["bytes_sent"])
+        self.assertEqual(self.transport.bytes_decoded,
+                         self.server.stats["bytes_uncompressed"])
+        self.assertTrue(self.transport.bytes_received * 5
+                        < self.transport.bytes_decoded)
+
+    def test_not_found(self):
+        try:
+            _mbngs_get_releases_by_discid("unknown-disc-id")
+        except musicbrainzngs.ResponseError as err:
+            self.assertEqual(err.cause.code, 404)
+        else:
+            self.fail("no error for an unknown disc ID")
+        # the connection can still be used
+        _mbngs_get_releases_by_discid("TqvKjMu7dMliSfmVEBtrL7sBSno-")
+        self.assertEqual(self.server.stats["connections"], 1)
+
+    def test_json(self):
+        client = isrcsubmit.JsonClient(self.transport, self.server.host)
+        includes = ["artists", "labels", "recordings", "isrcs"]
+        for disc_id in ["TqvKjMu7dMliSfmVEBtrL7sBSno-",
+                        "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"]:
+            expected = _mbngs_get_releases_by_discid(disc_id, includes)
+            result = client.get_releases_by_discid(disc_id, includes)
+            self.assertEqual(without_counts(result), without_counts(expected))
+        self.assertRaises(musicbrainzngs.ResponseError,
+                          client.get_release_by_id, "unknown-release-id")
+
+    def test_ws2_json(self):
+        # the layout of the JSON format, not converted from our fixtures
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        with open("%s%s_ws2.json" % (TEST_DATA, disc_id)) as data:
+            result = isrcsubmit.from_json(json.load(data))
+        with open("%s%s_releases.json" % (TEST_DATA, disc_id)) as data:
+            expected = json.load(data)["disc"]
+        def used(release):
+            """The parts of a release isrcsubmit uses
+            """
+            media = []
+            for medium in release["medium-list"]:
+                tracks = [(track["position"], track["number"],
+                           track["track_or_recording_length"],
+                           track["recording"]["id"],
+                           track["recording"]["title"],
+                           track["recording"].get("isrc-list", []))
+                          for track in medium["track-list"]]
+                media.append(([disc["id"] for disc in medium["disc-list"]],
+                              tracks))
+            return (release["id"], release["title"],
+                    release["artist-credit-phrase"], release.get("barcode"),
+                    [label_info.get("catalog-number") for label_info
+                     in release.get("label-info-list", [])], media)
+        self.assertEqual(result["sectors"], expected["sectors"])
+        self.assertEqual([used(release) for release in result["release-list"]],
+                         [used(release)
+                          for release in expected["release-list"]])
+
+    def test_json_fallback(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                   "--server", self.server.host,
+                                   "--ws-format", "json",
+                                   "--cache-ttl", "0"])
+        ws2 = isrcsubmit.WebService2()
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        class FailingClient(object):
+            def __init__(self, error):
+                self.error = error
+            def get_releases_by_discid(self, disc_id, includes=[]):
+                raise self.error
+        musicbrainzngs.get_releases_by_discid = _mbngs_get_releases_by_discid
+        try:
+            # a network error falls back to XML for this lookup only
+            client = FailingClient(isrcsubmit.urllib_request.URLError(
+                    "connection reset"))
+            ws2.json_client = client
+            self.assertEqual(len(ws2.get_releases_by_discid(disc_id)), 1)
+            self.assertTrue(ws2.json_client is client)
+            # a broken response stops using JSON
+            ws2.json_client = FailingClient(ValueError("no JSON"))
+            self.assertEqual(len(ws2.get_releases_by_discid(disc_id)), 1)
+            self.assertTrue(ws2.json_client is None)
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            ws2.transport.close()
+
+    def test_cd_stub(self):
+        disc_id = "Wn8eRBtfLDfM0qjYPdxrz.Zjs_U-"
+        for ws_format in ["xml", "json"]:
+            isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                       "--server", self.server.host,
+                                       "--ws-format", ws_format,
+                                       "--cache-ttl", "0"])
+            ws2 = isrcsubmit.WebService2()
+            ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+            musicbrainzngs.get_releases_by_discid = \
+                    _mbngs_get_releases_by_discid
+            try:
+                self.assertEqual(ws2.get_releases_by_discid(disc_id), [])
+            finally:
+                musicbrainzngs.get_releases_by_discid = \
+                        _get_releases_by_discid
+            # the stub was no reason to fall back to XML
+            self.assertEqual(ws2.json_client is not None, ws_format == "json")
+            ws2.transport.close()
+
+    def test_isrc_lookup(self):
+        results = []
+        for ws_format in ["xml", "json"]:
+            # every format has its own cache entries
+            isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                       "--server", self.server.host,
+                                       "--ws-format", ws_format])
+            ws2 = isrcsubmit.WebService2()
+            ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+            results.append(ws2.get_recordings_by_isrc("GBBBN7902023",
+                                                      ["releases"]))
+            self.assertEqual(ws2.get_recordings_by_isrc("DEA120000001"), [])
+            # the second lookup is cached
+            ws2.get_recordings_by_isrc("GBBBN7902023", ["releases"])
+            ws2.transport.close()
+        self.assertEqual(self.server.stats["requests"], 4)
+        self.assertEqual(without_counts(results[0]),
+                         without_counts(results[1]))
+        self.assertEqual(len(results[0]), 1)
+        self.assertEqual(len(results[0][0]["release-list"]), 7)
+
+    def test_lookup_server(self):
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        for ws_format in ["json", "xml"]:
+            isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                       "--server", "main.invalid",
+                                       "--lookup-server", self.server.host,
+                                       "--ws-format", ws_format,
+                                       "--cache-ttl", "0"])
+            ws2 = isrcsubmit.WebService2()
+            musicbrainzngs.get_releases_by_discid = \
+                    _mbngs_get_releases_by_discid
+            try:
+                # the mirror is not rate limited
+                start = time.time()
+                for i in range(3):
+                    releases = ws2.get_releases_by_discid(disc_id)
+                    self.assertEqual(len(releases), 1)
+                self.assertTrue(time.time() - start < 1)
+            finally:
+                musicbrainzngs.get_releases_by_discid = \
+                        _get_releases_by_discid
+            self.assertEqual(ws2.json_client is not None, ws_format == "json")
+            self.assertEqual(musicbrainzngs.musicbrainz.hostname,
+                             "main.invalid")
+            ws2.transport.close()
+
+    def test_parallel_mirror(self):
+        mirror = mbstandin.StandIn(latency=0.3)
+        mirror.start()
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                   "--server", self.server.host,
+                                   "--lookup-server", mirror.host,
+                                   "--cache-ttl", "0"])
+        ws2 = isrcsubmit.WebService2()
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        release_id = "07090529-0fbf-4bd3-adc4-fe627343976d"
+        tasks = [isrcsubmit.BackgroundTask(ws2.get_releases_by_discid,
+                                           (disc_id,))
+                 for i in range(3)]
+        musicbrainzngs.get_releases_by_discid = _mbngs_get_releases_by_discid
+        try:
+            start = time.time()
+            for task in tasks:
+                task.start()
+            # requests to the main server are not routed to the mirror
+            ws2._request(self.server.host, isrcsubmit.PRIORITY_INTERACTIVE,
+                         "get_release_by_id", _mbngs_get_release_by_id,
+                         release_id)
+            for task in tasks:
+                self.assertEqual(len(task.result()), 1)
+            # the lookups on the mirror didn't wait for each other
+            self.assertTrue(time.time() - start < 0.6)
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            ws2.transport.close()
+            mirror.shutdown()
+            mirror.server_close()
+        self.assertEqual(mirror.stats["requests"], 3)
+        self.assertEqual(self.server.stats["requests"], 1)
+
+    def test_submit(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring", "--server",
+                                   self.server.host, "--cache-ttl", "0"])
+        ws2 = isrcsubmit.WebService2("user")
+        musicbrainzngs.auth("user", "password")
+        ws2.auth = True
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        releases = ws2.get_releases_by_discid("TqvKjMu7dMliSfmVEBtrL7sBSno-",
+                                              ["recordings"])
+        track = releases[0]["medium-list"][0]["track-list"][0]
+        recording_id = track["recording"]["id"]
+        musicbrainzngs.submit_isrcs = _mbngs_submit_isrcs
+        try:
+            ws2.submit_isrcs({recording_id: "DEA120000001"})
+        finally:
+            musicbrainzngs.submit_isrcs = _submit_isrcs
+        self.assertEqual(self.server.submissions,
+                         [(recording_id, "DEA120000001")])
+        recording = self.server.fixtures.recordings[recording_id][0]
+        self.assertTrue("DEA120000001" in recording["isrc-list"])
+        ws2.transport.close()
+
+    def test_chunked_submit(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring", "--server",
+                                   self.server.host, "--cache-ttl", "0",
+                                   "--chunk-size", "1"])
+        ws2 = isrcsubmit.WebService2("user")
+        musicbrainzngs.auth("user", "password")
+        ws2.auth = True
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        recording_id = sorted(self.server.fixtures.recordings)[0]
+        tracks2isrcs = {recording_id: "DEA120000001",
+                        "unknown-recording": "DEA120000002"}
+        failures = []
+        def submit_isrcs(tracks2isrcs):
+            # the first request fails on the way
+            if not failures:
+                failures.append(tracks2isrcs)
+                raise musicbrainzngs.NetworkError("connection lost")
+            return _mbngs_submit_isrcs(tracks2isrcs)
+        musicbrainzngs.submit_isrcs = submit_isrcs
+        backoff = isrcsubmit.SUBMIT_BACKOFF
+        isrcsubmit.SUBMIT_BACKOFF = 0.01
+        try:
+            submitted = ws2.submit_isrcs(tracks2isrcs)
+        finally:
+            musicbrainzngs.submit_isrcs = _submit_isrcs
+            isrcsubmit.SUBMIT_BACKOFF = backoff
+        # the rejected chunk doesn't stop the other one
+        self.assertEqual(submitted, set([recording_id]))
+        self.assertEqual(self.server.submissions,
+                         [(recording_id, "DEA120000001")])
+        self.assertEqual(self.server.stats["requests"], 2)
+        ws2.transport.close()
+
+    class SubmittedDisc(object):
+        def __init__(self, release):
+            self.release = isrcsubmit.CompactRelease(release)
+
+    def test_verify(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring", "--server",
+                                   self.server.host, "--verify"])
+        ws2 = isrcsubmit.WebService2("user")
+        musicbrainzngs.auth("user", "password")
+        ws2.auth = True
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        release_id = "07090529-0fbf-4bd3-adc4-fe627343976d"
+        includes = ["recordings", "isrcs"]
+        release = ws2.get_release_by_id(release_id, includes)["release"]
+        disc = self.SubmittedDisc(release)
+        tracks = disc.release["medium-list"][0]["track-list"]
+        recording_ids = [track["recording"]["id"] for track in tracks]
+        old_ws2 = isrcsubmit.ws2
+        isrcsubmit.ws2 = ws2
+        musicbrainzngs.submit_isrcs = _mbngs_submit_isrcs
+        try:
+            # a single recording is looked up
+            tracks2isrcs = {recording_ids[0]: "DEA120000001"}
+            self.assertEqual(ws2.get_recordings_by_isrc("DEA120000001"), [])
+            ws2.submit_isrcs(tracks2isrcs)
+            requests = self.server.stats["requests"]
+            isrcsubmit.verify_submission([(disc, tracks2isrcs)])
+            self.assertEqual(self.server.stats["requests"] - requests, 1)
+            # more recordings are browsed on the release
+            tracks2isrcs = {recording_ids[1]: "DEA120000002",
+                            recording_ids[2]: "DEA120000003"}
+            ws2.submit_isrcs(tracks2isrcs)
+            requests = self.server.stats["requests"]
+            isrcsubmit.verify_submission([(disc, tracks2isrcs)])
+            self.assertEqual(self.server.stats["requests"] - requests, 1)
+        finally:
+            musicbrainzngs.submit_isrcs = _submit_isrcs
+            isrcsubmit.ws2 = old_ws2
+        # the unknown ISRC isn't cached anymore
+        self.assertTrue(ws2.cache.get(isrcsubmit.ReleaseCache.key(
+                "isrc", "DEA120000001", ws_format="xml")) is None)
+        # the release in memory and the cached one were updated
+        requests = self.server.stats["requests"]
+        cached = ws2.get_release_by_id(release_id, includes)["release"]
+        self.assertEqual(self.server.stats["requests"], requests)
+        for release in [disc.release, cached]:
+            tracks = release["medium-list"][0]["track-list"]
+            for number, isrc in enumerate(["DEA120000001", "DEA120000002",
+                                           "DEA120000003"]):
+                self.assertTrue(isrc in tracks[number]["recording"]
+                                                  ["isrc-list"])
+        ws2.transport.close()
+
+    def test_server_errors(self):
+        client = isrcsubmit.JsonClient(self.transport, self.server.host)
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        self.server.rate_limit = 1
+        client.get_releases_by_discid(disc_id)
+        self.assertRaises(EnvironmentError,
+                          client.get_releases_by_discid, disc_id)
+        self.assertEqual(self.server.stats["rate_limited"], 1)
+        self.server.rate_limit = None
+        self.server.error_rate = 1
+        try:
+            client.get_releases_by_discid(disc_id)
+        except EnvironmentError as err:
+            self.assertEqual(err.code, 503)
+        else:
+            self.fail("no error for an overloaded server")
+        self.assertEqual(self.server.stats["errors"], 1)
+
+    def test_server_retries(self):
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring", "--server",
+                                   self.server.host, "--cache-ttl", "0"])
+        ws2 = isrcsubmit.WebService2("user")
+        musicbrainzngs.auth("user", "password")
+        ws2.auth = True
+        ws2.rate_limiter = isrcsubmit.RateLimiter(rate=100)
+        disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        recording_id = sorted(self.server.fixtures.recordings)[0]
+        backoff = isrcsubmit.SERVER_BACKOFF
+        isrcsubmit.SERVER_BACKOFF = 0.01
+        musicbrainzngs.get_releases_by_discid = _mbngs_get_releases_by_discid
+        musicbrainzngs.submit_isrcs = _mbngs_submit_isrcs
+        self.server.error_rate = 1
+        try:
+            # musicbrainzngs doesn't retry on top of our attempts
+            self.assertRaises(SystemExit, ws2.get_releases_by_discid, disc_id)
+            retries = isrcsubmit.SERVER_RETRIES
+            self.assertEqual(self.server.stats["errors"], retries + 1)
+            self.assertEqual(ws2.submit_isrcs({recording_id: "DEA120000001"}),
+                             set())
+            self.assertEqual(self.server.stats["errors"], 2 * (retries + 1))
+            self.server.error_rate = 0
+            self.assertTrue(ws2.get_releases_by_discid(disc_id))
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            musicbrainzngs.submit_isrcs = _submit_isrcs
+            isrcsubmit.SERVER_BACKOFF = backoff
+        ws2.transport.close()
+
+    def tearDown(self):
+        musicbrainzngs.compat.HTTPHandler = self._handler
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self._config_home)
+
+
+class TestOfflineIndex(unittest.TestCase):
+    disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+
+    def setUp(self):
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
+        with open("%s%s_releases.json" % (TEST_DATA, self.disc_id)) as data:
+            self.releases = json.load(data)["disc"]["release-list"]
+        # a dump has one release per line
+        self.dump = os.path.join(self._config_home, "release")
+        with open(self.dump, "wb") as dump:
+            for release in self.releases:
+                dump.write(mbstandin.to_json({"release": release}) + b"\n")
+
+    def test_import(self):
+        index = isrcsubmit.OfflineIndex()
+        self.assertEqual(index.import_dump(self.dump, "musicbrainz.org"),
+                         len(self.releases))
+        self.assertEqual(index.server(), "musicbrainz.org")
+        expected = sorted(self.releases, key=lambda release: release["id"])
+        releases = index.releases_by_discid(self.disc_id)
+        self.assertEqual(without_counts(releases), without_counts(expected))
+        release = index.release(expected[0]["id"])
+        self.assertEqual(without_counts(release), without_counts(expected[0]))
+        self.assertEqual(index.releases_by_discid("unknown-disc-id"), None)
+        self.assertEqual(index.release("unknown-release-id"), None)
+
+    def test_import_archive(self):
+        archive_path = os.path.join(self._config_home, "mbdump.tar")
+        with tarfile.open(archive_path, "w") as archive:
+            archive.add(self.dump, "mbdump/release")
+        index = isrcsubmit.OfflineIndex()
+        self.assertEqual(index.import_dump(archive_path, "musicbrainz.org"),
+                         len(self.releases))
+
+    def test_lookup(self):
+        isrcsubmit.OfflineIndex().import_dump(self.dump, "main.invalid")
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                   "--server", "main.invalid",
+                                   "--offline-index"])
+        ws2 = isrcsubmit.WebService2()
+        # no request is necessary
+        def unavailable(*args, **kwargs):
+            self.fail("request sent for an imported release")
+        ws2._request = unavailable
+        releases = ws2.get_releases_by_discid(self.disc_id)
+        self.assertEqual(len(releases), len(self.releases))
+        release = ws2.get_release_by_id(releases[0]["id"])
+        self.assertEqual(release["release"]["id"], releases[0]["id"])
+
+    def test_unused(self):
+        isrcsubmit.OfflineIndex().import_dump(self.dump, "main.invalid")
+        for args in [[], ["--offline-index", "--server", "test.invalid"]]:
+            isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                       "--server", "main.invalid",
+                                       "--cache-ttl", "0"] + args)
+            ws2 = isrcsubmit.WebService2()
+            self.assertTrue(ws2.index is None)
+
+    def test_submitted(self):
+        isrcsubmit.OfflineIndex().import_dump(self.dump, "main.invalid")
+        isrcsubmit.gather_options([SCRIPT_NAME, "--no-keyring",
+                                   "--server", "main.invalid",
+                                   "--offline-index", "--cache-ttl", "0"])
+        ws2 = isrcsubmit.WebService2()
+        release_ids = sorted([release["id"] for release in self.releases])
+        release = ws2.index.release(release_ids[0])
+        track = release["medium-list"][0]["track-list"][0]
+        recording_id = track["recording"]["id"]
+        # confirmed ISRCs are added to the release
+        ws2.add_confirmed_isrcs(release_ids[0],
+                                {recording_id: "DEA120000001"})
+        release = ws2.index.release(release_ids[0])
+        track = release["medium-list"][0]["track-list"][0]
+        self.assertTrue("DEA120000001" in track["recording"]["isrc-list"])
+        # other releases ISRCs were submitted to are looked up again
+        ws2.invalidate(release_ids[1:2])
+        self.assertTrue(ws2.index.release(release_ids[1]) is None)
+        self.assertEqual(len(ws2.index.releases_by_discid(self.disc_id)),
+                         len(self.releases) - 1)
+
+    def tearDown(self):
+        shutil.rmtree(self._config_home)
+
+
+class TestJournal(unittest.TestCase):
+    class SubmittingWebService(object):
+        def __init__(self):
+            self.requests = []
+
+        def submit_isrcs(self, tracks2isrcs, release_ids=()):
+            self.requests.append((dict(tracks2isrcs), set(release_ids)))
+            return set(tracks2isrcs)
+
+    def setUp(self):
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
+        self._old_ws2 = isrcsubmit.ws2
+        isrcsubmit.ws2 = self.SubmittingWebService()
+        with open(os.devnull, 'w') as devnull:
+            self._old_stdout = os.dup(sys.stdout.fileno())
+            os.dup2(devnull.fileno(), 1)
+
+    def test_flush(self):
+        journal = isrcsubmit.Journal()
+        journal.record({"rec-1": "DEA121500001", "rec-2": "DEA121500002"},
+                       "disc-1", "release-1")
+        # the same disc in another drive
+        journal.record({"rec-1": "DEA121500001"}, "disc-1", "release-1")
+        journal.record({"rec-3": "DEA121500003"}, "disc-2", "release-2")
+        # a second ISRC for the same recording needs another request
+        journal.record({"rec-1": "DEA121500009"}, "disc-3", "release-3")
+        self.assertEqual(len(journal.pending()), 5)
+
+        isrcsubmit.flush_journal()
+        self.assertEqual(isrcsubmit.ws2.requests, [
+            ({"rec-1": "DEA121500001", "rec-2": "DEA121500002",
+              "rec-3": "DEA121500003"}, set(["release-1", "release-2"])),
+            ({"rec-1": "DEA121500009"}, set(["release-3"]))])
+        self.assertEqual(journal.pending(), [])
+
+        # nothing is submitted twice
+        isrcsubmit.flush_journal()
+        self.assertEqual(len(isrcsubmit.ws2.requests), 2)
+
+    def test_partial_flush(self):
+        journal = isrcsubmit.Journal()
+        journal.record({"rec-1": "DEA121500001", "rec-2": "DEA121500002"},
+                       "disc-1", "release-1")
+        # the chunk with rec-2 is rejected
+        isrcsubmit.ws2.submit_isrcs = lambda tracks2isrcs, release_ids: \
+                set(["rec-1"])
+        self.assertRaises(SystemExit, isrcsubmit.flush_journal)
+        self.assertEqual([entry[1:3] for entry in journal.pending()],
+                         [("rec-2", "DEA121500002")])
+
+    def tearDown(self):
+        os.dup2(self._old_stdout, 1)
+        isrcsubmit.ws2 = self._old_ws2
+        shutil.rmtree(self._config_home)
 
 
 # mock musicbrainzngs queries
@@ -84,6 +927,7 @@ class TestInternal(unittest.TestCase):
 _mbngs_get_releases_by_discid = musicbrainzngs.get_releases_by_discid
 _mbngs_get_release_by_id = musicbrainzngs.get_release_by_id
 _mbngs_submit_isrcs = musicbrainzngs.submit_isrcs
+_mbngs_get_recordings_by_isrc = musicbrainzngs.get_recordings_by_isrc
 
 def _get_releases_by_discid(disc_id, includes=[]):
     file_name = "%s%s_releases.json" % (TEST_DATA, disc_id)
@@ -251,7 +1095,7 @@ def handle_question(string):
         last_question = "submit_disc"
     elif "help clean" in string:
         last_question = "clean"
-    elif "ISRC in browser" in string:
+    elif "ISRC in the browser" in string:
         last_question = "open_isrc"
     # question and prompt can be on different writes
     if "[y/N]" in string: question = True; default = False
@@ -290,6 +1134,9 @@ class TestScript(unittest.TestCase):
         global answers, data_sent, mocked_disc_id
         global last_question
 
+        self._config_home = tempfile.mkdtemp()
+        os.environ["XDG_CONFIG_HOME"] = self._config_home
+
         # make sure globals are unset
         answers = data_sent = {}
         mocked_disc_id = last_question = None
@@ -362,11 +1209,501 @@ class TestScript(unittest.TestCase):
             self.assert_output("GBBBN7902023 is already attached to track 7")
             self.assert_output("No new ISRCs")
 
+    def test_stopped_extraction(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        # none of the releases is chosen
+        answers["choice"] = 0
+        tmpdirs = []
+        old_private_tempdir = isrcsubmit.private_tempdir
+        def private_tempdir(prefix):
+            tmpdirs.append(tempfile.mkdtemp(prefix=prefix))
+            return tmpdirs[-1]
+        def slow_cdrdao(args, **kwargs):
+            if args[0] == "cdrdao":
+                return Popen(["sleep", "30"], **kwargs)
+            return _Popen(args, **kwargs)
+        isrcsubmit.private_tempdir = private_tempdir
+        isrcsubmit.Popen = slow_cdrdao
+        start = time.time()
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                             "--device", "/dev/cdrw"])
+        except SystemExit:
+            pass
+        finally:
+            isrcsubmit.private_tempdir = old_private_tempdir
+            isrcsubmit.Popen = _Popen
+        # cdrdao was stopped and cleaned up after itself
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(len(tmpdirs), 1)
+        self.assertFalse(os.path.exists(tmpdirs[0]))
+        self.assertEqual(isrcsubmit.extractions, [])
+        self.assertFalse("returned with" in self._output())
+
+    def test_multiple_drives(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--devices", "/dev/cdrw,/dev/cdrom"])
+        except SystemExit:
+            pass
+        finally:
+            self.assert_output("/dev/cdrw")
+            self.assert_output("/dev/cdrom")
+            self.assert_output("07090529-0fbf-4bd3-adc4-fe627343976d")
+            self.assertEqual(self._output().count(
+                        "DEC680000220 is already attached to track 4"), 2)
+            self.assert_output("No new ISRCs")
+
+    def test_isrc_index_opened_once(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        opened = []
+        isrc_index = isrcsubmit.IsrcIndex
+        class CountedIndex(isrc_index):
+            def __init__(self, *args, **kwargs):
+                opened.append(self)
+                isrc_index.__init__(self, *args, **kwargs)
+        isrcsubmit.IsrcIndex = CountedIndex
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--devices", "/dev/cdrw,/dev/cdrom"])
+        except SystemExit:
+            pass
+        finally:
+            isrcsubmit.IsrcIndex = isrc_index
+        self.assertEqual(len(opened), 1)
+
+    def test_ambiguous_medium(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        get_mb_tracks = isrcsubmit.get_mb_tracks
+        matched = []
+        def ambiguous(disc):
+            # the first disc is on several media of the release
+            if not matched:
+                matched.append(disc)
+                raise discid.DiscError("number of discs with id: 2")
+            return get_mb_tracks(disc)
+        isrcsubmit.get_mb_tracks = ambiguous
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--devices", "/dev/cdrw,/dev/cdrom"])
+        except SystemExit:
+            pass
+        finally:
+            isrcsubmit.get_mb_tracks = get_mb_tracks
+        # the other drive is still handled
+        self.assertEqual(self._output().count(
+                    "DEC680000220 is already attached to track 4"), 1)
+        self.assert_output("No new ISRCs")
+
+    def test_manifest(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        release_id = "07090529-0fbf-4bd3-adc4-fe627343976d"
+        manifest = os.path.join(self._config_home, "manifest")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("# disc ID, release ID\n"
+                                "TqvKjMu7dMliSfmVEBtrL7sBSno- %s\n"
+                                "4QErGPmWoXZEA8ztu4.c2aApaUA- %s\n"
+                                "hSI7B4G4AkB5.DEBcW.3KCn.D_E- %s\n"
+                                % (release_id, release_id, release_id))
+        fetched = []
+        def get_release_by_id(release_id, includes=[]):
+            fetched.append(release_id)
+            return _get_release_by_id(release_id, includes)
+        def unavailable(*args, **kwargs):
+            self.fail("release not primed from the manifest")
+        errors = []
+        print_error = isrcsubmit.print_error
+        musicbrainzngs.get_release_by_id = get_release_by_id
+        musicbrainzngs.get_releases_by_discid = unavailable
+        isrcsubmit.print_error = lambda *args: errors.extend(args)
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--manifest", manifest])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_release_by_id = _get_release_by_id
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            isrcsubmit.print_error = print_error
+            isrcsubmit.manifest = {}
+        # the release of both discs is only fetched once
+        self.assertEqual(fetched, [release_id])
+        self.assert_output("Fetched 1 releases for 2 discs")
+        self.assertEqual(errors, ["Disc ID hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+                                  " is not attached to release %s"
+                                  % release_id])
+        self.assert_output("DEC680000220 is already attached to track 4")
+
+    def test_brief(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        lookups = []
+        def get_releases_by_discid(disc_id, includes=[]):
+            lookups.append(includes)
+            return _get_releases_by_discid(disc_id, includes)
+        musicbrainzngs.get_releases_by_discid = get_releases_by_discid
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--brief"])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+        self.assertEqual(lookups, [["recordings", "isrcs"]])
+        self.assert_output("07090529-0fbf-4bd3-adc4-fe627343976d")
+        self.assert_output("DEC680000220 is already attached to track 4")
+
+    def test_prefetch(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        answers["choice"] = 1
+        with open("%s%s_releases.json" % (TEST_DATA, mocked_disc_id)) as data:
+            releases = json.load(data)["disc"]["release-list"]
+        lookups = []
+        fetched = []
+        def get_releases_by_discid(disc_id, includes=[]):
+            lookups.append(includes)
+            return _get_releases_by_discid(disc_id, includes)
+        def get_release_by_id(release_id, includes=[]):
+            fetched.append(release_id)
+            for release in releases:
+                if release["id"] == release_id:
+                    return {"release": release}
+        musicbrainzngs.get_releases_by_discid = get_releases_by_discid
+        musicbrainzngs.get_release_by_id = get_release_by_id
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                             "--device", "/dev/cdrw", "--prefetch", "2"])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            musicbrainzngs.get_release_by_id = _get_release_by_id
+        # the choice is shown without the recordings
+        self.assertEqual(lookups, [["artists", "labels"]])
+        # the chosen release was prefetched, others may still be pending
+        self.assertEqual(fetched.count(releases[0]["id"]), 1)
+        self.assertTrue(set(fetched)
+                        <= set(release["id"] for release in releases[:2]))
+        self.assert_output("GBBBN7902023 is already attached to track 7")
+
+    def test_auto_select(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        # the MCN is the barcode of the first release
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                             "--device", "/dev/cdrw", "--auto-select", "0.9"])
+        except SystemExit:
+            pass
+        self.assertFalse("Which one do you want?" in self._output())
+        self.assert_output("chose 174a5513-73d1-3c9d-a316-3c1c179e35f8")
+        self.assert_output("GBBBN7902023 is already attached to track 7")
+
+    def test_review_queue(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        def read_without_mcn(device=None, features=[]):
+            disc = _read(device, features)
+            disc.mcn = "0000000000000"
+            return disc
+        review = os.path.join(self._config_home, "review.txt")
+        isrcsubmit.discid.read = read_without_mcn
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                             "--device", "/dev/cdrw", "--auto-select", "0.9",
+                             "--review", review])
+        except SystemExit:
+            pass
+        finally:
+            isrcsubmit.discid.read = _read
+        self.assertFalse("Which one do you want?" in self._output())
+        self.assert_output("queued for review")
+        # the queue is a manifest with every release commented out
+        self.assertEqual(isrcsubmit.read_manifest(review), [])
+        with open(review) as review_file:
+            lines = review_file.readlines()
+        self.assertEqual(len(lines), 8)
+        with open(review, "w") as review_file:
+            review_file.write(lines[1][1:])
+        self.assertEqual(isrcsubmit.read_manifest(review),
+                         [(mocked_disc_id, lines[1].split()[1])])
+
+    def test_prefetch_auto_select(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        with open("%s%s_releases.json" % (TEST_DATA, mocked_disc_id)) as data:
+            releases = json.load(data)["disc"]["release-list"]
+        tracks = releases[0]["medium-list"][0]["track-list"]
+        def read_without_mcn(device=None, features=[]):
+            disc = _read(device, features)
+            disc.mcn = "0000000000000"
+            # the TOC of the first release
+            for track in disc.tracks:
+                length = int(tracks[track.number - 1]["length"])
+                track.sectors = length * 75 // 1000
+            return disc
+        def get_release_by_id(release_id, includes=[]):
+            for release in releases:
+                if release["id"] == release_id:
+                    return {"release": release}
+        def get_releases_by_discid(disc_id, includes=[]):
+            result = _get_releases_by_discid(disc_id, includes)
+            if "recordings" not in includes:
+                for release in result["disc"]["release-list"]:
+                    for medium in release["medium-list"]:
+                        medium.pop("track-list", None)
+            return result
+        scores = []
+        isrcsubmit.discid.read = read_without_mcn
+        musicbrainzngs.get_releases_by_discid = get_releases_by_discid
+        musicbrainzngs.get_release_by_id = get_release_by_id
+        try:
+            for args in [[], ["--prefetch", "2"]]:
+                review = os.path.join(self._config_home, "review%d.txt"
+                                      % len(scores))
+                try:
+                    isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                                     "--device", "/dev/cdrw",
+                                     "--auto-select", "0.9",
+                                     "--lookup-server", "mirror.invalid",
+                                     "--review", review] + args)
+                except SystemExit:
+                    pass
+                with open(review) as review_file:
+                    scores.append([line.split()[3]
+                                   for line in review_file.readlines()[1:]])
+        finally:
+            isrcsubmit.discid.read = _read
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            musicbrainzngs.get_release_by_id = _get_release_by_id
+        # the track lengths are compared with the prefetched details
+        self.assertTrue("1.00" in scores[0])
+        self.assertEqual(scores[1], scores[0])
+
+    def test_check_isrcs(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        answers["clean"] = True
+        answers["open_isrc"] = False
+        foreign = {"id": "foreign-recording", "title": "Other Song",
+                   "isrc-list": ["DEC680000220"],
+                   "release-list": [{"id": "other-release",
+                                     "title": "Other Release"}]}
+        looked_up = []
+        def get_recordings_by_isrc(isrc, includes=[]):
+            looked_up.append(isrc)
+            if isrc == "DEC680000220":
+                return {"isrc": {"id": isrc, "recording-list": [foreign]}}
+            raise musicbrainzngs.ResponseError(cause=
+                    isrcsubmit.urllib_request.HTTPError("", 404, "Not Found",
+                                                        None, None))
+        musicbrainzngs.get_recordings_by_isrc = get_recordings_by_isrc
+        try:
+            # lookups on a mirror are not rate limited
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--check-isrcs",
+                             "--lookup-server", "mirror.invalid"])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_recordings_by_isrc = \
+                    _mbngs_get_recordings_by_isrc
+        self.assertEqual(len(looked_up), len(set(looked_up)))
+        self.assertTrue("DEC680000220" in looked_up)
+        self.assert_output("ISRC DEC680000220 attached to:")
+        self.assert_output("on Other Release")
+
+    def test_check_isrcs_report(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        foreign = {"id": "foreign-recording", "title": "Other Song",
+                   "isrc-list": ["DEC680000220"],
+                   "release-list": [{"id": "other-release",
+                                     "title": "Other Release"}]}
+        looked_up = []
+        def get_recordings_by_isrc(isrc, includes=[]):
+            looked_up.append(isrc)
+            if isrc == "DEC680000220":
+                return {"isrc": {"id": isrc, "recording-list": [foreign]}}
+            return {"isrc": {"id": isrc, "recording-list": []}}
+        path = os.path.join(self._config_home, "report.json")
+        musicbrainzngs.get_recordings_by_isrc = get_recordings_by_isrc
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                             "--check-isrcs", "--report", path,
+                             "--lookup-server", "mirror.invalid",
+                             "--cache-ttl", "0"])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_recordings_by_isrc = \
+                    _mbngs_get_recordings_by_isrc
+            isrcsubmit.report = None
+        # the report uses the recordings looked up for the check
+        self.assertEqual(len(looked_up), len(set(looked_up)))
+        entry = isrcsubmit.DuplicateReport(path).entries[0]
+        self.assertEqual(entry["isrc"], "DEC680000220")
+        recordings = dict([(recording["id"], recording)
+                           for recording in entry["recordings"]])
+        self.assertEqual(recordings["foreign-recording"]["title"],
+                         "Other Song")
+
+    def test_isrc_index(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        answers["clean"] = True
+        answers["open_isrc"] = False
+        # the ISRC was found for another recording on an earlier disc
+        isrc = isrcsubmit.Isrc("DEC680000220", {"id": "other-recording"})
+        isrcsubmit.IsrcIndex().record({"DEC680000220": isrc}, "other-disc",
+                                      "other-release", "cdrdao")
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid"])
+        except SystemExit:
+            pass
+        self.assert_output("ISRC DEC680000220 attached to:")
+        self.assert_output("other-recording")
+        self.assert_output("on other-release")
+
+        # every ISRC of the disc was recorded
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--query-isrc", "DEC-680000220"])
+        except SystemExit:
+            pass
+        self.assert_output("ISRC DEC680000220 was seen for 2 recordings")
+        self.assert_output("disc ID TqvKjMu7dMliSfmVEBtrL7sBSno-")
+        self.assert_output("found with cdrdao")
+        self.assert_output("found with libdiscid")
+        self.assertEqual(len(isrcsubmit.IsrcIndex().lookup("DEC680000212")),
+                         1)
+
+    def test_isrc_index_declined(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        def get_releases_by_discid(disc_id, includes=[]):
+            # none of the ISRCs are on the server yet
+            result = _get_releases_by_discid(disc_id, includes)
+            for release in result["disc"]["release-list"]:
+                for medium in release["medium-list"]:
+                    for track in medium.get("track-list", []):
+                        track["recording"].pop("isrc-list", None)
+            return result
+        musicbrainzngs.get_releases_by_discid = get_releases_by_discid
+        try:
+            for args in [[], ["--devices", "/dev/cdrw,/dev/cdrom"]]:
+                try:
+                    isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                                     "--lookup-server", "mirror.invalid",
+                                     "--cache-ttl", "0"] + args)
+                except SystemExit:
+                    pass
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+        self.assertEqual(self._output().count("Nothing was submitted"), 2)
+        # the ISRCs were not accepted, so they are not used for checks
+        self.assertEqual(isrcsubmit.IsrcIndex().lookup("DEC680000212"), [])
+
+    def test_report(self):
+        global mocked_disc_id
+        mocked_disc_id = "TqvKjMu7dMliSfmVEBtrL7sBSno-"
+        isrc = isrcsubmit.Isrc("DEC680000220", {"id": "other-recording"})
+        isrcsubmit.IsrcIndex().record({"DEC680000220": isrc}, "other-disc",
+                                      "other-release", "cdrdao")
+        other = {"id": "other-recording", "title": "Other <Song>",
+                 "release-list": [{"id": "other-release",
+                                   "title": "Other Release"}]}
+        def get_recordings_by_isrc(isrc, includes=[]):
+            return {"isrc": {"id": isrc, "recording-list": [other]}}
+        musicbrainzngs.get_recordings_by_isrc = get_recordings_by_isrc
+        try:
+            for name in ["report.html", "report.json"]:
+                path = os.path.join(self._config_home, name)
+                # the second run replaces the entries of the disc
+                for i in range(2):
+                    try:
+                        isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                                         "--lookup-server", "mirror.invalid",
+                                         "--report", path])
+                    except SystemExit:
+                        pass
+                    report = isrcsubmit.DuplicateReport(path)
+                    self.assertEqual(len(report.entries), 1)
+            # once the duplicate is gone the disc has no entries
+            index = isrcsubmit.open_database("isrcs.db",
+                                             isrcsubmit.IsrcIndex.schema)
+            index.execute("DELETE FROM seen")
+            index.commit()
+            index.close()
+            try:
+                isrcsubmit.main([SCRIPT_NAME, "--backend", "libdiscid",
+                                 "--lookup-server", "mirror.invalid",
+                                 "--report", path])
+            except SystemExit:
+                pass
+            self.assertEqual(isrcsubmit.DuplicateReport(path).entries, [])
+        finally:
+            musicbrainzngs.get_recordings_by_isrc = \
+                    _mbngs_get_recordings_by_isrc
+            isrcsubmit.report = None
+        self.assertFalse("help clean" in self._output())
+        entry = report.entries[0]
+        self.assertEqual(entry["isrc"], "DEC680000220")
+        self.assertEqual(entry["disc_id"], mocked_disc_id)
+        recordings = dict([(recording["id"], recording)
+                           for recording in entry["recordings"]])
+        self.assertEqual(recordings["other-recording"]["title"],
+                         "Other <Song>")
+        self.assertEqual(len(recordings), 2)
+        with open(os.path.join(self._config_home, "report.html")) as html:
+            html = html.read()
+        self.assertTrue("Other &lt;Song&gt;" in html)
+        self.assertTrue("Other Release" in html)
+
+    def test_record_replay(self):
+        global mocked_disc_id
+        mocked_disc_id = "hSI7B4G4AkB5.DEBcW.3KCn.D_E-"
+        answers["choice"] = 1
+        cassette = os.path.join(self._config_home, "cassette")
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--backend", "cdrdao",
+                             "--device", "/dev/cdrw", "--record", cassette])
+        except SystemExit:
+            pass
+
+        # neither the drive, the backend nor the web service are used
+        mocked_disc_id = None
+        def unavailable(*args, **kwargs):
+            self.fail("not replayed")
+        musicbrainzngs.get_releases_by_discid = unavailable
+        isrcsubmit.Popen = unavailable
+        try:
+            isrcsubmit.main([SCRIPT_NAME, "--device", "/dev/cdrw",
+                             "--replay", cassette])
+        except SystemExit:
+            pass
+        finally:
+            musicbrainzngs.get_releases_by_discid = _get_releases_by_discid
+            isrcsubmit.Popen = _Popen
+            isrcsubmit.cassette = None
+        output = self._output()
+        self.assertEqual(output.count("mocked cdrdao"), 2)
+        self.assertEqual(output.count(
+                    "GBBBN7902023 is already attached to track 7"), 2)
+        self.assertFalse("Not recorded" in output)
+
     def tearDown(self):
         # restore output
         sys.stdout = self._old_stdout
         self._stdout.close()
         sys.stdin = self._old_stdin
+        shutil.rmtree(self._config_home)
 
 
 